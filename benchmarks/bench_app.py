@@ -0,0 +1,313 @@
+"""Mäter hur app.py klarar sig när historiken växer
+
+Genererar syntetiska lindas_streak_data.json med 10, 1k, 100k och 1M incheckningar,
+kör get_streak_data, update_streak, save_log och dataförberedelsen i trendanalysen
+med Streamlit utbytt mot en attrapp, och skriver latens-percentiler, minnestopp och
+minnet som varje ny session håller kvar till en JSON-fil, tillsammans med appens
+importtid vid kallstart.
+
+    python benchmarks/bench_app.py --sizes 10 1000 --output bench_results.json
+    python benchmarks/bench_app.py --compare main.json --output branch.json
+"""
+import argparse
+import datetime
+import functools
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = [10, 1_000, 100_000, 1_000_000]
+BACKENDS = ["journal", "sqlite"]
+# Moduler som inte ska behöva importeras för att starta appen
+HEAVY_MODULES = ["pandas", "plotly.express", "pyarrow", "numpy"]
+# Besökar-id som mätningarna använder, det ärver den genererade lindas_streak_data.json
+BENCH_VISITOR = "v-" + "bench".ljust(32, "0")
+
+
+class _SessionState(dict):
+    """Som st.session_state: en dict som också går att nå med attribut"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __delattr__(self, name):
+        del self[name]
+
+
+def _noop(*args, **kwargs):
+    return None
+
+
+def _resource_cache(func=None, **kwargs):
+    # Resurser utan argument (lagringen, läscachen) delas som i Streamlit,
+    # övriga anrop körs utan cache så att varje anrop mäter hela arbetet
+    def decorate(f):
+        if f.__code__.co_argcount:
+            return f
+        return functools.lru_cache(maxsize=None)(f)
+    return decorate(func) if func is not None else decorate
+
+
+def _passthrough_cache(func=None, **kwargs):
+    return func if func is not None else (lambda f: f)
+
+
+def install_streamlit_stub():
+    """Ersätter streamlit med en attrapp där alla anrop som ritar något gör ingenting"""
+    st = types.ModuleType("streamlit")
+    st.session_state = _SessionState()
+    st.query_params = {"user": BENCH_VISITOR}
+    st.cache_resource = _resource_cache
+    st.cache_data = _passthrough_cache
+    st.__getattr__ = lambda name: _noop
+    sys.modules["streamlit"] = st
+    return st
+
+
+def write_streak_file(path, size, feelings, phases, seed=1):
+    """Skriver en syntetisk lindas_streak_data.json med size incheckningar"""
+    rng = random.Random(seed)
+    start = datetime.date.today() - datetime.timedelta(days=size * 2 // 3 + 1)
+    dates = [(start + datetime.timedelta(days=i * 2 // 3)).isoformat() for i in range(size)]
+    chosen_feelings = [rng.choice(feelings) for _ in range(size)]
+    chosen_phases = [rng.choice(phases) for _ in range(size)]
+
+    # Filen skrivs i delar så att även 1M incheckningar går att generera
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"current_streak": 1, "last_check_in": "%s", "highest_streak": 30, '
+                '"total_check_ins": %d,\n"feelings_log": [' % (dates[-1] if dates else "", size))
+        f.write(",\n".join('{"date": "%s", "feeling": "%s"}' % pair for pair in zip(dates, chosen_feelings)))
+        f.write('],\n"phases_log": [')
+        f.write(",\n".join('{"date": "%s", "phase": "%s"}' % pair for pair in zip(dates, chosen_phases)))
+        f.write("]}\n")
+
+
+def summarize(samples):
+    """Returnerar latens-percentiler i millisekunder"""
+    ordered = sorted(samples)
+
+    def percentile(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "n": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": ordered[-1] * 1000
+    }
+
+
+def measure(func, iterations):
+    """Tidtar func och mäter minnestoppen för ett extra anrop"""
+    samples = []
+    for _ in range(iterations):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = summarize(samples)
+    result["peak_memory_kb"] = peak / 1024
+    return result
+
+
+def session_memory(app, st, sessions=50):
+    """Mäter hur mycket minne varje ny webbläsarsession håller kvar efter en incheckning"""
+    content = app.get_content()
+    shared = st.session_state
+    states = []
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for _ in range(sessions):
+        # Varje session har ett eget session_state, som i Streamlit
+        st.session_state = _SessionState()
+        streak_data = app.get_streak_data()
+        st.session_state.feeling = content.feelings[0]
+        st.session_state.energy_phase = content.energy_phases[0]
+        st.session_state.celebration = app.get_celebration_message(streak_data["current_streak"])
+        states.append(st.session_state)
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    st.session_state = shared
+    return {"n": sessions, "per_session_kb": (after - before) / sessions / 1024}
+
+
+def bench_size(app, storage, st, size, backend, iterations):
+    """Kör alla mätningar för en historikstorlek och ett lagringsval"""
+    content = app.get_content()
+    workdir = tempfile.mkdtemp(prefix=f"livspuls_bench_{backend}_{size}_")
+    os.chdir(workdir)
+    write_streak_file(storage.LEGACY_STREAK_FILE, size, content.feelings, content.energy_phases)
+
+    app.STORAGE_KIND = backend
+    app.get_storage.cache_clear()
+    app.get_snapshot_cache.cache_clear()
+    app.get_writer.cache_clear()
+    st.session_state.clear()
+    results = {}
+
+    # Första inläsningen flyttar över den gamla filen till lagringen
+    start = time.perf_counter()
+    app.get_streak_data()
+    results["migrate"] = {"n": 1, "mean_ms": (time.perf_counter() - start) * 1000}
+
+    def get_streak_data():
+        # Ny session, snapshoten hämtas från läscachen om ingen har skrivit
+        st.session_state.clear()
+        app.get_streak_data()
+
+    def load():
+        # Utan läscachen, så att snapshoten verkligen läses från lagringen
+        app.get_storage().load(app.get_user())
+
+    def update_streak():
+        app.update_streak(random.choice(content.feelings), random.choice(content.energy_phases))
+
+    def save_log():
+        app.save_log("Lugn", "Vila", "mikroaction", "pep talk", "fråga", "en kort reflektion")
+
+    def trend_prep():
+        streak_data = app.get_streak_data()
+        app.build_trend_figures(app.get_user(), streak_data["data_version"],
+                                streak_data.get("rollup_generation", 0), streak_data)
+
+    def read_history():
+        app.get_storage().read_history(app.get_user())
+
+    results["get_streak_data"] = measure(get_streak_data, iterations)
+    results["load"] = measure(load, iterations)
+    results["session_memory"] = session_memory(app, st)
+    results["update_streak"] = measure(update_streak, iterations)
+    results["save_log"] = measure(save_log, iterations)
+
+    # Med skrivning i bakgrunden mäter update_streak och save_log bara kön, här mäts resten
+    start = time.perf_counter()
+    app.get_writer().flush()
+    results["writer_flush"] = {"n": 1, "mean_ms": (time.perf_counter() - start) * 1000}
+    results["trend_prep"] = measure(trend_prep, max(1, iterations // 10))
+    results["read_history"] = measure(read_history, max(1, iterations // 10))
+    return results
+
+
+def import_profile():
+    """Mäter importtiden för appen och dess tunga beroenden i en ny process, som vid en kallstart
+
+    Körs med appens standardinställningar, och väntar in uppvärmningen i bakgrunden
+    så att det den läser in också räknas med bland de tunga beroendena.
+    """
+    code = (f"import sys, threading; sys.path[:0] = [{ROOT!r}, {os.path.dirname(os.path.abspath(__file__))!r}]; "
+            "import bench_app; bench_app.install_streamlit_stub(); import app; "
+            "[thread.join() for thread in threading.enumerate() if thread.name == 'livspuls-warmup']")
+    env = {key: value for key, value in os.environ.items() if key != "LIVSPULS_WARMUP"}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env, cwd=tempfile.gettempdir(),
+                            capture_output=True, text=True, check=True)
+
+    # Raderna ser ut som "import time: self [us] | cumulative | modul", indraget efter djup
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.setdefault(name.strip(), int(cumulative) / 1000)
+    profile = {"app_ms": modules.get("app")}
+    for name in HEAVY_MODULES:
+        profile[f"{name}_loaded"] = name in modules
+    return profile
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current, threshold):
+    """Skriver ut mätningar som blivit långsammare än tröskeln jämfört med en tidigare körning"""
+    regressions = []
+    for key, ops in current["results"].items():
+        for op, stats in ops.items():
+            before = previous["results"].get(key, {}).get(op)
+            if not before or "p50_ms" not in stats or not before.get("p50_ms"):
+                continue
+            ratio = stats["p50_ms"] / before["p50_ms"]
+            marker = "  <-- långsammare" if ratio > threshold else ""
+            print(f"{key:>16} {op:<16} {before['p50_ms']:10.3f} -> {stats['p50_ms']:10.3f} ms  x{ratio:.2f}{marker}")
+            if ratio > threshold:
+                regressions.append((key, op, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="JSON-fil från en tidigare körning att jämföra med")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Kvot för p50 som räknas som en försämring vid --compare")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    # Uppvärmningen i bakgrunden skulle störa mätningarna
+    os.environ["LIVSPULS_WARMUP"] = "0"
+    os.environ["LIVSPULS_LEGACY_IDENTITY"] = BENCH_VISITOR
+    st = install_streamlit_stub()
+    sys.path.insert(0, ROOT)
+    import app
+    import storage
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "iterations": args.iterations,
+        "import_profile": import_profile(),
+        "results": {}
+    }
+    for backend in args.backends:
+        for size in args.sizes:
+            key = f"{backend}/{size}"
+            print(f"Mäter {key} ...", file=sys.stderr)
+            report["results"][key] = bench_size(app, storage, st, size, backend, args.iterations)
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultat sparat i {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if compare(previous, report, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Kontroll av streak-beräkningen för incheckningar i oordning och dubbletter
+
+Jämför funktionerna i streaks.py med en enkel uträkning dag för dag, för slumpade
+dagar som blandats om och där samma dag förekommer flera gånger, och kontrollerar
+att en snapshot som fått incheckningarna i oordning blir rätt efter omräkningen.
+
+    python benchmarks/check_streaks.py --rounds 500
+
+Avslutas med felkod 1 om något inte stämmer.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+import storage
+import streaks
+
+
+def reference(days, today):
+    """Räknar dag för dag, utan numpy, som facit"""
+    unique = sorted(set(days))
+    lengths, gap_list = [], []
+    for previous, day in zip([None] + unique, unique):
+        if previous is not None and day == previous + 1:
+            lengths[-1] += 1
+        else:
+            if previous is not None:
+                gap_list.append((previous + 1, day - previous - 1))
+            lengths.append(1)
+    return {
+        "current_streak": lengths[-1] if lengths else 0,
+        "highest_streak": max(lengths, default=0),
+        "last_check_in": streaks.day_date(unique[-1]).isoformat() if unique else "",
+        "gaps": gap_list,
+        "last_7": sum(1 for day in days if today - 7 < day <= today)
+    }
+
+
+def check_round(rng):
+    base = streaks.day_number(datetime.date(2024, 1, 1))
+    days = [base + rng.randrange(60) for _ in range(rng.randrange(0, 40))]
+    # Dubbletter och omblandad ordning, som efter en import
+    days += rng.sample(days, min(len(days), rng.randrange(0, 10)))
+    rng.shuffle(days)
+    today = base + rng.randrange(70)
+    expected = reference(days, today)
+
+    problems = []
+    got = streaks.compute_streaks(np.array(days, dtype=np.int32))
+    for key in ("current_streak", "highest_streak", "last_check_in"):
+        if got[key] != expected[key]:
+            problems.append(f"compute_streaks {key}: {got[key]!r}, väntat {expected[key]!r}")
+    starts, lengths = streaks.gaps(days)
+    if list(zip(starts.tolist(), lengths.tolist())) != expected["gaps"]:
+        problems.append(f"gaps: {list(zip(starts.tolist(), lengths.tolist()))}, väntat {expected['gaps']}")
+    last_7 = streaks.checkins_in_last(days, 7, streaks.day_date(today))
+    if last_7 != expected["last_7"]:
+        problems.append(f"checkins_in_last: {last_7}, väntat {expected['last_7']}")
+
+    # Snapshoten får incheckningarna i den omblandade ordningen och räknas om där det behövs
+    snapshot = storage.empty_snapshot()
+    for day in days:
+        storage.apply_checkin(snapshot, storage.make_checkin("Glad", "Vår", datetime.datetime.combine(
+            streaks.day_date(day), datetime.time(12))))
+    if snapshot.get("streaks_stale"):
+        storage.recalculate_streaks(snapshot, days)
+    for key in ("current_streak", "highest_streak", "last_check_in"):
+        if snapshot[key] != expected[key]:
+            problems.append(f"snapshot {key}: {snapshot[key]!r}, väntat {expected[key]!r}")
+    if snapshot["total_check_ins"] != len(days):
+        problems.append(f"snapshot total_check_ins: {snapshot['total_check_ins']}, väntat {len(days)}")
+    return [f"{problem} för dagarna {days}" for problem in problems]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    problems = [problem for _ in range(args.rounds) for problem in check_round(rng)]
+    for problem in problems[:20]:
+        print(problem)
+    print(f"{args.rounds} omgångar: {'OK' if not problems else f'{len(problems)} fel'}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,468 @@
+"""Lasttest: många samtidiga sessioner mot en riktig `streamlit run app.py`
+
+Startar en Streamlit-server per lagring och kopplar upp sessionerna mot den över
+samma websocket-protokoll som webbläsaren använder, en tråd och en anslutning per
+session. Varje session går igenom incheckningen, sparar reflektioner och tittar
+ibland på trendanalysen och reflektionerna, med en slumpad betänketid mellan
+klicken. Alla sessioner delar alltså serverns process, cacher, skrivare och lagring,
+precis som besökarna i en driftsatt app.
+
+Skriver genomströmning, latens-percentiler per omkörning (från klicket tills servern
+meddelat att körningen är klar), serverns minne per session och en kontroll av att
+allt som sessionerna sparat också finns i lagringen till en JSON-fil.
+
+    python benchmarks/load_test.py --sessions 20 --duration 60 --output load_results.json
+    python benchmarks/load_test.py --backends sqlite --compare main.json --output branch.json
+
+Minnet per session är (serverns RSS med alla sessioner anslutna - RSS efter en
+uppvärmande session) / antal sessioner, så det som alla sessioner delar (importer,
+innehållspaket) räknas inte in. Klienten körs på samma maskin och delar processorn
+med servern.
+"""
+import argparse
+import collections
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from bench_app import BACKENDS, compare, git_revision, summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "app.py")
+VIEW_CHECKIN, VIEW_TRENDS, VIEW_REFLECTIONS = "Dagens Incheckning", "Trendanalys", "Reflektioner"
+# Sekunder att vänta på att servern startar och på varje omkörning
+TIMEOUT = 120
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_rss_kb(pid):
+    """Returnerar en annan process nuvarande minne (RSS) i kB"""
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024
+    except OSError:
+        # Utan /proc (t.ex. macOS) frågar vi ps, som redan svarar i kB
+        return float(subprocess.check_output(["ps", "-o", "rss=", "-p", str(pid)], text=True))
+
+
+class Server:
+    """En `streamlit run app.py` i en egen process, som i drift"""
+
+    def __init__(self, backend, data_dir, workdir):
+        self.port = free_port()
+        self.url = f"ws://127.0.0.1:{self.port}/_stcore/stream"
+        env = dict(os.environ, LIVSPULS_STORAGE=backend, LIVSPULS_DATA_DIR=data_dir)
+        self.log_path = os.path.join(workdir, f"server_{backend}.log")
+        with open(self.log_path, "w") as log:
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", "streamlit", "run", APP, "--server.headless", "true",
+                 "--server.address", "127.0.0.1", "--server.port", str(self.port),
+                 "--browser.gatherUsageStats", "false", "--server.fileWatcherType", "none"],
+                cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+            )
+        self._wait_healthy()
+
+    def _wait_healthy(self):
+        deadline = time.monotonic() + TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Servern avslutades vid start, se {self.log_path}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=1) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"Servern svarade inte inom {TIMEOUT} s, se {self.log_path}")
+
+    def rss_kb(self):
+        return process_rss_kb(self.process.pid)
+
+    def stop(self):
+        """Stänger servern som vid en vanlig avstängning, så skrivarens kö töms först"""
+        self.process.terminate()
+        try:
+            return self.process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            return self.process.wait()
+
+
+class Client:
+    """En webbläsarflik: skickar widgetvärden och tar emot sidan som servern ritar"""
+
+    def __init__(self, connection, user):
+        self.connection = connection
+        self.query_string = f"user={user}"
+
+    def run(self, widgets=()):
+        """Kör om appen med de ändrade widgetarna och returnerar sidan som ett ElementTree"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ClientState_pb2 import ClientState
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        from streamlit.proto.WidgetStates_pb2 import WidgetStates
+        from streamlit.testing.v1.element_tree import parse_tree_from_messages
+
+        # Som webbläsaren skickas bara widgetar som ändrats, servern minns resten
+        state = ClientState(query_string=self.query_string, widget_states=WidgetStates(widgets=widgets))
+        self.connection.send(BackMsg(rerun_script=state).SerializeToString())
+        deltas = []
+        while True:
+            msg = ForwardMsg()
+            msg.ParseFromString(self.connection.recv(timeout=TIMEOUT))
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                # Varje körning, även den efter st.rerun, ritar om hela sidan
+                deltas = []
+            elif kind == "delta":
+                deltas.append(msg)
+            elif kind == "page_info_changed":
+                self.query_string = msg.page_info_changed.query_string
+            elif kind == "script_finished" and msg.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                if msg.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise RuntimeError("app.py gick inte att kompilera")
+                return parse_tree_from_messages(deltas)
+
+
+def choose(radio, value):
+    from streamlit.proto.WidgetStates_pb2 import WidgetState
+    return WidgetState(id=radio.id, string_value=value)
+
+
+def click(button):
+    from streamlit.proto.WidgetStates_pb2 import WidgetState
+    return WidgetState(id=button.id, trigger_value=True)
+
+
+def type_text(text_area, text):
+    from streamlit.proto.WidgetStates_pb2 import WidgetState
+    return WidgetState(id=text_area.id, string_value=text)
+
+
+class Expected:
+    """Det som en session har sparat, per användare, att jämföra med lagringen efteråt"""
+
+    def __init__(self):
+        self.checkins = collections.Counter()
+        self.feelings = collections.defaultdict(collections.Counter)
+        self.phases = collections.defaultdict(collections.Counter)
+        self.reflections = collections.Counter()
+        self.texts = collections.defaultdict(list)
+
+    def checkin(self, user, feeling, phase):
+        self.checkins[user] += 1
+        self.feelings[user][feeling] += 1
+        self.phases[user][phase] += 1
+
+    def reflection(self, user, text=None):
+        self.reflections[user] += 1
+        if text:
+            self.texts[user].append(text)
+
+    def merge(self, other):
+        """Lägger till det som en annan session sparat"""
+        self.checkins.update(other.checkins)
+        self.reflections.update(other.reflections)
+        for user in other.checkins.keys() | other.reflections.keys():
+            self.feelings[user].update(other.feelings[user])
+            self.phases[user].update(other.phases[user])
+            self.texts[user] += other.texts[user]
+        return self
+
+
+class Session:
+    """En webbläsarsession som klickar sig igenom appen"""
+
+    def __init__(self, number, user, think_time, seed, client=None):
+        self.number = number
+        self.user = user
+        self.client = client
+        self.expected = Expected()
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+        self.page = None
+        self.samples = collections.defaultdict(list)  # Steg -> sekunder för omkörningen
+        self.errors = []
+        self.saved = 0
+
+    def run(self, step, *widgets):
+        """Kör om appen som efter ett klick och tidtar omkörningen"""
+        start = time.perf_counter()
+        self.page = self.client.run(widgets)
+        self.samples[step].append(time.perf_counter() - start)
+        if self.page.exception:
+            raise RuntimeError(f"{step}: {self.page.exception[0].message}")
+
+    def think(self):
+        if self.think_time > 0:
+            time.sleep(self.rng.expovariate(1 / self.think_time))
+
+    def button(self, label):
+        return next(button for button in self.page.button if button.label == label)
+
+    def view(self, name, step):
+        self.run(step, choose(self.page.radio(key="view"), name))
+
+    def visit(self):
+        """Ett besök: en incheckning, en reflektion och ibland en titt på trender och loggen"""
+        feeling_radio, phase_radio = [radio for radio in self.page.radio if radio.key != "view" and not radio.label]
+        feeling = self.rng.choice(feeling_radio.options)
+        phase = self.rng.choice(phase_radio.options)
+        self.run("checkin", choose(feeling_radio, feeling), choose(phase_radio, phase),
+                 click(self.button("💫 Fortsätt")))
+        self.expected.checkin(self.user, feeling, phase)
+        self.think()
+
+        if self.rng.random() < 0.6:
+            text = f"lasttest {self.number}-{self.saved} {self.rng.getrandbits(32):08x}"
+            self.run("reflection", type_text(self.page.text_area[0], text), click(self.button("Spara min reflektion")))
+            self.expected.reflection(self.user, text)
+        else:
+            radio = next(radio for radio in self.page.radio if radio.label == "Vill du svara på reflektionsfrågan?")
+            self.run("choose", choose(radio, "Nej"))
+            self.run("reflection", click(self.button("Fortsätt utan reflektion")))
+            self.expected.reflection(self.user)
+        self.saved += 1
+        self.think()
+
+        if self.rng.random() < 0.3:
+            self.view(VIEW_TRENDS, "trends")
+            self.think()
+            self.view(VIEW_CHECKIN, "view")
+        if self.rng.random() < 0.1:
+            self.view(VIEW_REFLECTIONS, "reflections")
+            self.think()
+            self.view(VIEW_CHECKIN, "view")
+
+        self.run("new_checkin", click(self.button("Starta en ny incheckning")))
+        self.think()
+
+    def loop(self, deadline):
+        while time.monotonic() < deadline:
+            self.visit()
+        # Reflektionsvyn väntar in sessionens skrivningar, så kontrollen efteråt ser allt som sparats
+        self.view(VIEW_REFLECTIONS, "reflections")
+        if self.page.warning:
+            self.errors.append(f"skrivarens kö tömdes inte: {self.page.warning[0].value}")
+
+
+def run_session(session, url, duration, started, finished, release):
+    """Kör en session i en egen tråd med en egen anslutning till servern"""
+    from websockets.sync.client import connect
+
+    with contextlib.ExitStack() as stack:
+        try:
+            connection = stack.enter_context(connect(url, subprotocols=["streamlit"], max_size=None,
+                                                     open_timeout=TIMEOUT))
+            session.client = Client(connection, session.user)
+            # Första omkörningen startar sessionen på servern, före startlinjen
+            session.run("start")
+        except Exception as e:
+            session.errors.append(repr(e))
+        # Alla väntar vid startlinjen och mätningen även om något gick fel, annars blir de andra stående
+        started.wait()
+        if not session.errors:
+            try:
+                session.loop(time.monotonic() + duration)
+            except Exception as e:
+                session.errors.append(repr(e))
+        finished.wait()
+        # Anslutningen hålls öppen tills serverns minne är mätt med alla sessioner kvar
+        release.wait()
+
+
+def warm_up(server, user):
+    """Öppnar alla vyer en gång, så att serverns importer och delade cacher finns före mätningen"""
+    from websockets.sync.client import connect
+    with connect(server.url, subprotocols=["streamlit"], max_size=None, open_timeout=TIMEOUT) as connection:
+        session = Session(-1, user, 0, 0, Client(connection, user))
+        session.run("start")
+        session.visit()
+        for view in (VIEW_TRENDS, VIEW_REFLECTIONS):
+            session.view(view, "warmup")
+
+
+def snapshot_counts(storage, user):
+    """Returnerar räknarna i lagringen som kontrollen jämför"""
+    snapshot = storage.load(user)
+    rows = sum(batch.num_rows for batch in storage.iter_history(user)) + snapshot.get("rolled_up", 0)
+    entries = [entry for chunk in storage.user_reflections(user).iter_entries(user) for entry in chunk]
+    return {
+        "total_check_ins": snapshot["total_check_ins"],
+        "history_rows": rows,
+        "feelings": collections.Counter(snapshot["feeling_counts"]),
+        "phases": collections.Counter(snapshot["phase_counts"]),
+        "reflections": len(entries),
+        "texts": collections.Counter(entry["reflection"] for entry in entries if entry["reflection"])
+    }
+
+
+def check_data(storage, users, before, expected):
+    """Jämför lagringen med det sessionerna sparat, returnerar en lista med avvikelser"""
+    problems = []
+    for user in users:
+        after = snapshot_counts(storage, user)
+        start = before[user]
+        for key, wanted in (("total_check_ins", expected.checkins[user]), ("history_rows", expected.checkins[user]),
+                            ("reflections", expected.reflections[user])):
+            got = after[key] - start[key]
+            if got != wanted:
+                problems.append(f"{user}: {key} ökade med {got}, väntat {wanted}")
+        for key, wanted in (("feelings", expected.feelings[user]), ("phases", expected.phases[user])):
+            got = after[key] - start[key]
+            if got != wanted:
+                problems.append(f"{user}: {key} ökade med {dict(got)}, väntat {dict(wanted)}")
+        missing = [text for text in expected.texts[user] if after["texts"][text] != 1]
+        if missing:
+            problems.append(f"{user}: {len(missing)} reflektioner saknas eller finns flera gånger, t.ex. {missing[0]!r}")
+    return problems
+
+
+def load_test(backend, data_dir, workdir, sessions, users, duration, think_time, seed):
+    """Kör lasttestet mot en server med en lagring och returnerar resultatet"""
+    from storage import open_storage
+
+    # Besökar-id som appen godtar i ?user=, så sessionerna kan dela användare
+    names = ["v-" + f"lasttest{i}".ljust(32, "0") for i in range(users)]
+    storage = open_storage(backend, data_dir)
+    before = {user: snapshot_counts(storage, user) for user in names}
+
+    server = Server(backend, data_dir, workdir)
+    try:
+        warm_up(server, "v-" + "lasttestwarmup".ljust(32, "0"))
+        # Uppvärmningens session stängs innan grundnivån mäts
+        time.sleep(1)
+        baseline = server.rss_kb()
+
+        started = threading.Barrier(sessions + 1)
+        finished = threading.Barrier(sessions + 1)
+        release = threading.Event()
+        clients = [Session(i, names[i % users], think_time, seed + i) for i in range(sessions)]
+        threads = [threading.Thread(target=run_session, name=f"session-{session.number}",
+                                    args=(session, server.url, duration, started, finished, release))
+                   for session in clients]
+        for thread in threads:
+            thread.start()
+        # Klockan startar när alla sessioner har öppnat appen
+        started.wait()
+        start = time.perf_counter()
+        finished.wait()
+        elapsed = time.perf_counter() - start
+        loaded = server.rss_kb()
+        release.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        # Servern stängs innan kontrollen, så att allt i skrivarens kö hunnit sparas
+        exit_code = server.stop()
+
+    expected = Expected()
+    samples = collections.defaultdict(list)
+    for session in clients:
+        expected.merge(session.expected)
+        for step, values in session.samples.items():
+            samples[step] += values
+    reruns = [value for step, values in samples.items() if step != "start" for value in values]
+    checkins = sum(expected.checkins.values())
+
+    results = {"rerun": summarize(reruns)}
+    for step, values in sorted(samples.items()):
+        results[f"step.{step}"] = summarize(values)
+    results["throughput"] = {
+        "seconds": elapsed,
+        "reruns_per_s": len(reruns) / elapsed,
+        "checkins_per_s": checkins / elapsed,
+        "checkins": checkins,
+        "reflections": sum(expected.reflections.values()),
+        "cpus": os.cpu_count()
+    }
+    results["memory"] = {
+        "sessions": sessions,
+        "server_baseline_kb": baseline,
+        "server_loaded_kb": loaded,
+        "per_session_kb": (loaded - baseline) / sessions
+    }
+    results["errors"] = [f"session {session.number}: {error}" for session in clients for error in session.errors]
+    if exit_code != 0:
+        results["errors"].append(f"servern avslutades med kod {exit_code}, se {server.log_path}")
+    results["data_loss"] = check_data(storage, names, before, expected)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--users", type=int, default=None,
+                        help="Antal användare som sessionerna delar på, standard är hälften av sessionerna")
+    parser.add_argument("--duration", type=float, default=30, help="Sekunder som sessionerna klickar")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Medelvärde för betänketiden i sekunder")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--data-dir", help="Datakatalog att testa mot, standard är en ny temporär katalog")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="load_results.json")
+    parser.add_argument("--compare", help="JSON-fil från en tidigare körning att jämföra med")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Kvot för p50 som räknas som en försämring vid --compare")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    users = args.users or max(1, args.sessions // 2)
+    sys.path.insert(0, ROOT)
+    # Appen läser och skriver relativt arbetskatalogen, så den gamla JSON-filen i repot inte rörs
+    workdir = tempfile.mkdtemp(prefix="livspuls_load_")
+    os.chdir(workdir)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "sessions": args.sessions,
+        "users": users,
+        "duration": args.duration,
+        "think_time": args.think_time,
+        "results": {}
+    }
+    for backend in args.backends:
+        data_dir = os.path.abspath(args.data_dir or os.path.join(workdir, f"data_{backend}"))
+        print(f"Kör {args.sessions} sessioner mot {backend} i {args.duration:g} s ...", file=sys.stderr)
+        result = load_test(backend, data_dir, workdir, args.sessions, users, args.duration, args.think_time,
+                           args.seed)
+        report["results"][backend] = result
+        print(f"{backend}: {result['throughput']['reruns_per_s']:.1f} omkörningar/s, "
+              f"p50 {result['rerun']['p50_ms']:.0f} ms, p95 {result['rerun']['p95_ms']:.0f} ms, "
+              f"p99 {result['rerun']['p99_ms']:.0f} ms, {result['memory']['per_session_kb']:.0f} kB per session",
+              file=sys.stderr)
+        for problem in result["errors"] + result["data_loss"]:
+            print(f"  {problem}", file=sys.stderr)
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Resultat sparat i {output}", file=sys.stderr)
+
+    failed = any(result["errors"] or result["data_loss"] for result in report["results"].values())
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        failed = bool(compare(previous, report, args.threshold)) or failed
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Stresstest: hundratals samtidiga incheckningar från flera processer och trådar
+
+Varje process startar ett antal trådar som väntar vid en gemensam startlinje och
+sedan sparar sina incheckningar så tätt de kan, mot samma användare. Efteråt ska
+total_check_ins, historikens längd och aggregaten stämma exakt med antalet
+incheckningar, och streak-räknarna med en omräkning från historiken.
+
+    python benchmarks/stress_checkins.py --processes 4 --threads 8 --checkins 25
+
+Journalen komprimeras var sjunde incheckning, så även komprimeringen körs samtidigt
+med andras skrivningar. Avslutas med felkod 1 om något inte stämmer.
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import storage
+
+BACKENDS = ["journal", "sqlite"]
+USER = "stress"
+COMPACT_EVERY = 7
+FEELINGS = ["Glad", "Lugn", "Trött", "Orolig"]
+PHASES = ["Vår", "Sommar", "Höst", "Vinter"]
+
+
+class StressJournalStorage(storage.JournalStorage):
+    """Journallagring som komprimerar ofta, så att komprimeringen också utsätts för trängsel"""
+
+    def journal(self, user):
+        directory = os.path.join(self.root, storage.check_user(user))
+        return storage.CheckinJournal(directory, legacy_file=None, compact_every=COMPACT_EVERY)
+
+
+def open_stress_storage(backend, root):
+    if backend == "journal":
+        return StressJournalStorage(root, legacy_file=None, legacy_log_file=None)
+    return storage.SqliteStorage(os.path.join(root, storage.SQLITE_FILE), legacy_file=None, legacy_log_file=None)
+
+
+def make_records(worker, thread, count):
+    # Datumen slumpas över en månad, så en del incheckningar hamnar bakåt i tiden och räknar om streaken
+    rng = random.Random(worker * 1000 + thread)
+    start = datetime.datetime(2024, 1, 1, 12)
+    return [storage.make_checkin(rng.choice(FEELINGS), rng.choice(PHASES),
+                                 start + datetime.timedelta(days=rng.randrange(30)))
+            for _ in range(count)]
+
+
+def run_worker(backend, root, worker, threads, checkins, start_at):
+    """Kör i en egen process: trådarna sparar sina incheckningar en i taget"""
+    target = open_stress_storage(backend, root)
+    barrier = threading.Barrier(threads)
+    errors = []
+
+    def write(thread):
+        records = make_records(worker, thread, checkins)
+        barrier.wait()
+        try:
+            for record in records:
+                target.append(USER, record)
+        except Exception as e:
+            errors.append(repr(e))
+
+    # Alla processer börjar samtidigt, inte när de råkar ha startat
+    time.sleep(max(0.0, start_at - time.time()))
+    pool = [threading.Thread(target=write, args=(thread,)) for thread in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return errors
+
+
+def check(backend, root, expected):
+    """Jämför det sparade med det som skrevs, returnerar en lista med avvikelser"""
+    target = open_stress_storage(backend, root)
+    snapshot = target.load(USER)
+    rows = sum(batch.num_rows for batch in target.iter_history(USER))
+    problems = []
+    for name, got in (("total_check_ins", snapshot["total_check_ins"]), ("historikens längd", rows),
+                      ("data_version", snapshot["data_version"]),
+                      ("summan av feeling_counts", sum(snapshot["feeling_counts"].values())),
+                      ("summan av phase_counts", sum(snapshot["phase_counts"].values()))):
+        if got != expected:
+            problems.append(f"{name} är {got}, väntat {expected}")
+
+    recalculated = target.recalculate_streaks(USER)
+    for key in ("current_streak", "highest_streak", "last_check_in", "total_check_ins"):
+        if snapshot[key] != recalculated[key]:
+            problems.append(f"{key} är {snapshot[key]!r}, omräknat från historiken {recalculated[key]!r}")
+    return problems
+
+
+def stress(backend, processes, threads, checkins):
+    root = tempfile.mkdtemp(prefix=f"livspuls_stress_{backend}_")
+    expected = processes * threads * checkins
+    start_at = time.time() + 1.0
+    started = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        results = [pool.apply_async(run_worker, (backend, root, worker, threads, checkins, start_at))
+                   for worker in range(processes)]
+        errors = [error for result in results for error in result.get()]
+    elapsed = time.perf_counter() - started
+    problems = errors + check(backend, root, expected)
+    shutil.rmtree(root, ignore_errors=True)
+    return expected, elapsed, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8, help="Trådar per process")
+    parser.add_argument("--checkins", type=int, default=25, help="Incheckningar per tråd")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    args = parser.parse_args()
+
+    failed = False
+    for backend in args.backends:
+        expected, elapsed, problems = stress(backend, args.processes, args.threads, args.checkins)
+        status = "OK" if not problems else "FEL"
+        print(f"{backend}: {expected} incheckningar från {args.processes} processer × {args.threads} trådar "
+              f"på {elapsed:.1f} s: {status}")
+        for problem in problems:
+            print(f"  {problem}")
+        failed = failed or bool(problems)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""Massimport och -export av incheckningar och reflektioner, utan att starta appen
+
+    python cli.py export-checkins --user linda --output linda.parquet
+    python cli.py import-checkins --user anna --input anna.csv
+    python cli.py export-reflections --user linda --output reflektioner.jsonl
+    python cli.py import-reflections --user anna --input reflektioner.csv
+
+Formatet väljs från filändelsen (.csv, .jsonl, .parquet) eller med --format.
+Filerna läses och skrivs i bitar så att minnesåtgången inte växer med filens storlek.
+"""
+import argparse
+import collections
+import csv
+import datetime
+import json
+import os
+import sys
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from content import DEFAULT_PACK, load_pack
+from storage import REFLECTION_COLUMNS, open_storage
+
+CHECKIN_COLUMNS = ("date", "feeling", "phase")
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".parquet": "parquet"}
+
+
+def detect_format(path, fmt=None):
+    """Returnerar filformatet, från --format eller filändelsen"""
+    if fmt:
+        return fmt
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise SystemExit(f"Okänt filformat för {path}, ange --format csv, jsonl eller parquet")
+    return FORMATS[extension]
+
+
+def read_json_lines(f):
+    """Tolkar en JSON-rad i taget, en rad som inte går att tolka ges som None"""
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            yield None
+
+
+def read_chunks(path, fmt, chunk_size):
+    """Läser filen i bitar och ger listor med rader
+
+    Raderna är dictar, utom i JSONL där en rad kan vara vilket JSON-värde som helst,
+    eller None om den inte går att tolka. Importen räknar sådana rader som ogiltiga.
+    """
+    if fmt == "parquet":
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pylist()
+        return
+
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rows = csv.DictReader(f) if fmt == "csv" else read_json_lines(f)
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+class ChunkWriter:
+    """Skriver rader i bitar till CSV, JSONL eller Parquet"""
+
+    def __init__(self, path, fmt, columns):
+        self.fmt = fmt
+        self.columns = columns
+        self.rows = 0
+        if fmt == "parquet":
+            schema = pa.schema([(column, pa.string()) for column in columns])
+            self.writer = pq.ParquetWriter(path, schema)
+        else:
+            self.file = open(path, "w", encoding="utf-8", newline="")
+            if fmt == "csv":
+                self.writer = csv.DictWriter(self.file, fieldnames=columns, extrasaction="ignore")
+                self.writer.writeheader()
+
+    def write(self, rows):
+        if self.fmt == "parquet":
+            self.writer.write_table(pa.Table.from_pylist(rows, schema=self.writer.schema))
+        elif self.fmt == "csv":
+            self.writer.writerows(rows)
+        else:
+            self.file.writelines(json.dumps({c: row.get(c) for c in self.columns}, ensure_ascii=False) + "\n"
+                                 for row in rows)
+        self.rows += len(rows)
+
+    def close(self):
+        if self.fmt == "parquet":
+            self.writer.close()
+        else:
+            self.file.close()
+
+
+def valid_date(value):
+    try:
+        return datetime.date.fromisoformat(str(value)[:10]).isoformat()
+    except ValueError:
+        return None
+
+
+def export_checkins(storage, args):
+    writer = ChunkWriter(args.output, detect_format(args.output, args.format), CHECKIN_COLUMNS)
+    for batch in storage.iter_history(args.user, args.chunk_size):
+        dates = batch.column("day").cast(pa.date32()).cast(pa.string())
+        writer.write([{"date": date, "feeling": feeling, "phase": phase} for date, feeling, phase in
+                      zip(dates.to_pylist(), batch.column("feeling").to_pylist(), batch.column("phase").to_pylist())])
+    writer.close()
+    return {"exported": writer.rows}
+
+
+def import_checkins(storage, args):
+    pack = load_pack(args.pack)
+    feelings, phases = set(pack.feelings), set(pack.energy_phases)
+
+    # Dubbletter räknas per (datum, känsla, fas): efter importen finns varje kombination
+    # lika många gånger som i den fil eller lagring som har flest, så en export kan importeras igen
+    existing = collections.Counter()
+    for batch in storage.iter_history(args.user, args.chunk_size):
+        dates = batch.column("day").cast(pa.date32()).cast(pa.string()).to_pylist()
+        existing.update(zip(dates, batch.column("feeling").to_pylist(), batch.column("phase").to_pylist()))
+
+    seen = collections.Counter()
+    stats = collections.Counter()
+    for chunk in read_chunks(args.input, detect_format(args.input, args.format), args.chunk_size):
+        records = []
+        for row in chunk:
+            date = valid_date(row.get("date")) if isinstance(row, dict) else None
+            if date is None or row.get("feeling") not in feelings or row.get("phase") not in phases:
+                stats["invalid"] += 1
+                continue
+            key = (date, row["feeling"], row["phase"])
+            seen[key] += 1
+            if seen[key] <= existing[key]:
+                stats["duplicates"] += 1
+                continue
+            records.append({"ts": row.get("ts") or f"{date}T00:00:00", "date": date,
+                            "feeling": row["feeling"], "phase": row["phase"]})
+        if records and not args.dry_run:
+            storage.append_many(args.user, records)
+        stats["imported"] += len(records)
+    return dict(stats)
+
+
+def export_reflections(storage, args):
+    writer = ChunkWriter(args.output, detect_format(args.output, args.format), REFLECTION_COLUMNS)
+    for entries in storage.user_reflections(args.user).iter_entries(args.user, args.chunk_size):
+        writer.write(entries)
+    writer.close()
+    return {"exported": writer.rows}
+
+
+def import_reflections(storage, args):
+    pack = load_pack(args.pack)
+    feelings, phases = set(pack.feelings), set(pack.energy_phases)
+    index = storage.user_reflections(args.user)
+
+    stats = collections.Counter()
+    for chunk in read_chunks(args.input, detect_format(args.input, args.format), args.chunk_size):
+        entries = []
+        for row in chunk:
+            date = valid_date(row.get("date")) if isinstance(row, dict) else None
+            # Känsla och fas är frivilliga i en reflektion, men måste vara kända om de finns
+            if (date is None or row.get("feeling") not in feelings | {None, ""}
+                    or row.get("phase") not in phases | {None, ""}):
+                stats["invalid"] += 1
+                continue
+            entry = {column: row.get(column) or None for column in REFLECTION_COLUMNS}
+            entry["date"] = date
+            entries.append(entry)
+        # En provkörning gör samma dubblettkontroll men sparar inget
+        added = index.add_many(args.user, entries, dry_run=args.dry_run)
+        stats["imported"] += added
+        stats["duplicates"] += len(entries) - added
+    return dict(stats)
+
+
+COMMANDS = {
+    "export-checkins": export_checkins,
+    "import-checkins": import_checkins,
+    "export-reflections": export_reflections,
+    "import-reflections": import_reflections
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--input", help="Fil att importera")
+    parser.add_argument("--output", help="Fil att exportera till")
+    parser.add_argument("--format", choices=sorted(set(FORMATS.values())))
+    parser.add_argument("--storage", default=os.environ.get("LIVSPULS_STORAGE", "journal"))
+    parser.add_argument("--data-dir", default=os.environ.get("LIVSPULS_DATA_DIR", "livspuls_data"))
+    parser.add_argument("--pack", default=os.environ.get("LIVSPULS_CONTENT_PACK", DEFAULT_PACK),
+                        help="Innehållspaket vars känslor och faser räknas som giltiga")
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--dry-run", action="store_true", help="Kontrollera filen utan att spara något")
+    args = parser.parse_args(argv)
+
+    if args.command.startswith("import") and not args.input:
+        parser.error("--input krävs för import")
+    if args.command.startswith("export") and not args.output:
+        parser.error("--output krävs för export")
+
+    storage = open_storage(args.storage, args.data_dir)
+    stats = COMMANDS[args.command](storage, args)
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""Sammanställer statistik över alla användare, för en översikt utanför appen
+
+    python cohort.py --storage journal --data-dir livspuls_data --workers 8 --output cohort.json
+
+Varje process läser en del av användarna och räknar fram delresultat (räknare och
+histogram) som sedan slås ihop, så körtiden delas ungefär med antalet kärnor.
+"""
+import argparse
+import bisect
+import collections
+import concurrent.futures
+import datetime
+import json
+import os
+import sys
+
+import numpy as np
+
+from storage import open_storage, rollup_days
+from streaks import checkins_in_last, day_date, day_number, gaps, runs
+
+# Gränserna för streak-histogrammet, en streak på 5 dagar hamnar i "4-7"
+STREAK_BINS = (1, 2, 4, 8, 15, 31, 91, 181, 366)
+RETENTION_WEEKS = 52
+# Fönstren (dagar) för hur många användare som varit aktiva nyligen
+ACTIVE_WINDOWS = (7, 30, 90)
+
+
+class CohortStats:
+    """Delresultat som kan slås ihop, så att varje process kan räkna på sina användare"""
+
+    def __init__(self):
+        self.users = 0
+        self.checkins = 0
+        self.feelings = collections.Counter()
+        self.phases = collections.Counter()
+        self.streaks = collections.Counter()          # Längd -> antal sammanhängande följder
+        self.highest_streaks = collections.Counter()  # Längd -> antal användare med den som högsta
+        self.gaps = collections.Counter()             # Längd på uppehåll (dagar) -> antal uppehåll
+        self.active = collections.Counter()           # Fönster i dagar -> användare med incheckningar i det
+        self.active_weeks = collections.Counter()     # Vecka sedan första incheckningen -> aktiva användare
+        self.observed_weeks = collections.Counter()   # Sista veckan som kan observeras -> antal användare
+
+    def add_user(self, days, feelings, phases, as_of, checkins=None):
+        """Räknar in en användares dagnummer och känslo- och fasräkningar
+
+        checkins anges när days inte har en dag per incheckning, t.ex. för hoprullade månader.
+        """
+        if days.size == 0:
+            return
+        self.users += 1
+        self.checkins += int(days.size if checkins is None else checkins)
+        self.feelings.update(feelings)
+        self.phases.update(phases)
+
+        _, lengths = runs(days)
+        self.streaks.update(collections.Counter(lengths.tolist()))
+        self.highest_streaks[int(lengths.max())] += 1
+        _, gap_lengths = gaps(days)
+        self.gaps.update(collections.Counter(gap_lengths.tolist()))
+        for window in ACTIVE_WINDOWS:
+            if checkins_in_last(days, window, day_date(as_of)):
+                self.active[window] += 1
+
+        # Retention: vilka veckor efter den första incheckningen användaren var aktiv
+        first = int(days.min())
+        self.active_weeks.update(np.unique((days - first) // 7).tolist())
+        self.observed_weeks[max(0, (as_of - first) // 7)] += 1
+
+    def merge(self, other):
+        """Lägger till ett annat delresultat och returnerar det sammanslagna"""
+        self.users += other.users
+        self.checkins += other.checkins
+        for name in ("feelings", "phases", "streaks", "highest_streaks", "gaps", "active", "active_weeks",
+                     "observed_weeks"):
+            getattr(self, name).update(getattr(other, name))
+        return self
+
+    def report(self, weeks=RETENTION_WEEKS):
+        """Returnerar sammanställningen som en JSON-vänlig dict"""
+        return {
+            "users": self.users,
+            "checkins": self.checkins,
+            "feeling_distribution": _shares(self.feelings),
+            "phase_mix": _shares(self.phases),
+            "streak_histogram": _binned(self.streaks),
+            "highest_streak_histogram": _binned(self.highest_streaks),
+            "gap_histogram": _binned(self.gaps),
+            "active_users": {f"{window}d": self.active[window] for window in ACTIVE_WINDOWS},
+            "retention": self.retention(weeks)
+        }
+
+    def retention(self, weeks=RETENTION_WEEKS):
+        """Andel användare som checkat in vecka k efter sin första incheckning
+
+        Bara användare som funnits med i minst k veckor räknas i nämnaren.
+        """
+        curve = []
+        for week in range(weeks + 1):
+            eligible = sum(count for last, count in self.observed_weeks.items() if last >= week)
+            if eligible == 0:
+                break
+            active = self.active_weeks.get(week, 0)
+            curve.append({"week": week, "active": active, "eligible": eligible, "rate": active / eligible})
+        return curve
+
+
+def _shares(counter):
+    total = sum(counter.values())
+    ordered = sorted(counter.items(), key=lambda item: (-item[1], item[0]))
+    return {name: count / total for name, count in ordered} if total else {}
+
+
+def _binned(counter):
+    labels = [f"{low}" if high - 1 == low else f"{low}-{high - 1}" for low, high in zip(STREAK_BINS, STREAK_BINS[1:])]
+    labels.append(f"{STREAK_BINS[-1]}+")
+    bins = dict.fromkeys(labels, 0)
+    for length, count in counter.items():
+        bins[labels[bisect.bisect_right(STREAK_BINS, length) - 1]] += count
+    return bins
+
+
+def scan_users(kind, root, users, as_of):
+    """Räknar fram delresultatet för en grupp användare, körs i en egen process"""
+    storage = open_storage(kind, root)
+    stats = CohortStats()
+    for user in users:
+        snapshot = storage.load(user)
+        days = [batch.column("day").to_numpy(zero_copy_only=False) for batch in storage.iter_history(user)]
+        checkins = sum(part.size for part in days) + snapshot.get("rolled_up", 0)
+        # Hoprullade incheckningar finns kvar som en dag per incheckningsdag, det räcker för streaks och retention
+        days = np.concatenate([rollup_days(storage.rollups(user))] + days).astype(np.int64)
+        # Fördelningarna finns redan i snapshoten, historiken behövs bara för dagarna
+        stats.add_user(days, snapshot.get("feeling_counts", {}), snapshot.get("phase_counts", {}), as_of, checkins)
+    return stats
+
+
+def aggregate(kind, root, workers=None, as_of=None, chunks_per_worker=4):
+    """Läser alla användare parallellt och returnerar det sammanslagna resultatet"""
+    as_of = day_number(as_of or datetime.date.today())
+    users = open_storage(kind, root).users()
+    workers = workers or os.cpu_count() or 1
+    size = max(1, -(-len(users) // (workers * chunks_per_worker)))
+    groups = [users[i:i + size] for i in range(0, len(users), size)]
+
+    total = CohortStats()
+    if workers == 1:
+        for group in groups:
+            total.merge(scan_users(kind, root, group, as_of))
+        return total
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(scan_users, kind, root, group, as_of) for group in groups]
+        for future in concurrent.futures.as_completed(futures):
+            total.merge(future.result())
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--storage", default=os.environ.get("LIVSPULS_STORAGE", "journal"))
+    parser.add_argument("--data-dir", default=os.environ.get("LIVSPULS_DATA_DIR", "livspuls_data"))
+    parser.add_argument("--workers", type=int, default=None, help="Antal processer, standard är antalet kärnor")
+    parser.add_argument("--as-of", type=datetime.date.fromisoformat, default=None,
+                        help="Datum som retentionen räknas fram till, standard är idag")
+    parser.add_argument("--weeks", type=int, default=RETENTION_WEEKS)
+    parser.add_argument("--output", help="JSON-fil att skriva till, annars skrivs resultatet ut")
+    args = parser.parse_args(argv)
+
+    report = aggregate(args.storage, args.data_dir, args.workers, args.as_of).report(args.weeks)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"{report['users']} användare, {report['checkins']} incheckningar sammanställda i {args.output}",
+              file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
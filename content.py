@@ -0,0 +1,79 @@
+import bisect
+import functools
+import json
+import os
+import types
+
+# Innehållspaketen ligger som JSON-filer, ett per språk eller persona
+PACKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "content_packs")
+DEFAULT_PACK = "sv"
+
+
+class ContentPack:
+    """Oföränderliga uppslagstabeller för mikroactions, pep talks, frågor och firanden
+
+    Ett paket läses in en gång per process och delas sedan av alla sessioner.
+    """
+
+    def __init__(self, data):
+        self.name = data["name"]
+        self.title = data.get("title", self.name)
+        self.feelings = tuple(data["feelings"])
+        self.energy_phases = tuple(data["energy_phases"])
+
+        # Kombinationerna slås upp med (känsla, fas) som nyckel
+        self.microactions = types.MappingProxyType(_pairs(data["microactions"]))
+        self.pep_talks = types.MappingProxyType(_pairs(data["pep_talks"]))
+        self.cycle_questions = types.MappingProxyType(dict(data["cycle_questions"]))
+        self.default_microaction = data["default_microaction"]
+        self.default_pep_talk = data["default_pep_talk"]
+        self.default_cycle_question = data["default_cycle_question"]
+
+        # Milstolparna sorteras en gång så att uppslaget kan göras med bisect
+        celebrations = {int(streak): types.MappingProxyType(dict(message))
+                        for streak, message in data["celebrations"].items()}
+        self.milestones = tuple(sorted(celebrations))
+        self.celebrations = types.MappingProxyType(celebrations)
+
+    def microaction(self, feeling, energy_phase):
+        """Returnerar mikroactionen för känslan och energifasen"""
+        return self.microactions.get((feeling, energy_phase), self.default_microaction)
+
+    def pep_talk(self, feeling, energy_phase):
+        """Returnerar den peppande reflektionen för känslan och energifasen"""
+        return self.pep_talks.get((feeling, energy_phase), self.default_pep_talk)
+
+    def cycle_question(self, energy_phase):
+        """Returnerar reflektionsfrågan för energifasen"""
+        return self.cycle_questions.get(energy_phase, self.default_cycle_question)
+
+    def celebration(self, streak):
+        """Returnerar firandet för den högsta uppnådda milstolpen, eller None"""
+        index = bisect.bisect_right(self.milestones, streak)
+        if index == 0:
+            return None
+        return self.celebrations[self.milestones[index - 1]]
+
+
+def _pairs(table):
+    return {(feeling, phase): text
+            for feeling, phases in table.items()
+            for phase, text in phases.items()}
+
+
+def available_packs():
+    """Returnerar namnen på alla innehållspaket som finns"""
+    return sorted(name[:-len(".json")] for name in os.listdir(PACKS_DIR) if name.endswith(".json"))
+
+
+def load_pack(name=DEFAULT_PACK):
+    """Läser in ett innehållspaket, varje paket tolkas bara en gång per process"""
+    return _load_pack(name)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_pack(name):
+    if name not in available_packs():
+        raise ValueError(f"Okänt innehållspaket: {name!r}")
+    with open(os.path.join(PACKS_DIR, f"{name}.json"), "r", encoding="utf-8") as f:
+        return ContentPack(json.load(f))
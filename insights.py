@@ -0,0 +1,305 @@
+import collections
+import copy
+import threading
+
+import numpy as np
+
+from trends import WEEK_OFFSET, dictionary_codes
+
+# Antal dagar i fönstren som jämförs när vi letar efter förändringar
+WINDOW = 28
+# Minsta antal incheckningar bakom en insikt, så att enstaka dagar inte ger slutsatser
+MIN_SUPPORT = 5
+# Hur mycket vanligare (andel) något måste vara för att räknas som ett mönster
+MIN_LIFT = 1.25
+MIN_SHIFT = 0.15
+
+WEEKDAYS = ("måndagar", "tisdagar", "onsdagar", "torsdagar", "fredagar", "lördagar", "söndagar")
+SEASONS = ("vintern", "våren", "sommaren", "hösten")
+
+
+def _grow(counts, shape):
+    """Fyller ut en räknematris med nollor när nya känslor eller faser dykt upp"""
+    if counts.shape == shape:
+        return counts
+    return np.pad(counts, [(0, new - old) for old, new in zip(counts.shape, shape)])
+
+
+def _count(index, size):
+    return np.bincount(index, minlength=size)[:size]
+
+
+class Insights:
+    """Mönster i en användares historik, uppdateras stegvis med nya incheckningar
+
+    Allt hålls som räknematriser, så en uppdatering kostar bara i förhållande till
+    antalet nya incheckningar och insikterna läses av direkt ur matriserna.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.feeling_codes = {}
+        self.phase_codes = {}
+        self.pairs = np.zeros((0, 0), dtype=np.int64)        # Känsla × fas i samma incheckning
+        self.transitions = np.zeros((0, 0), dtype=np.int64)  # Känsla → känslan i nästa incheckning
+        self.weekdays = np.zeros((7, 0), dtype=np.int64)     # Veckodag × känsla
+        self.months = np.zeros((12, 0), dtype=np.int64)      # Månad × känsla
+        self.day_feelings = np.zeros(0, dtype=np.int64)      # Avslutade dagar per dagens sista känsla
+        self.breaks = np.zeros(0, dtype=np.int64)            # ... som följdes av ett uppehåll
+        self.last_day = None
+        self.last_feeling = None
+        # Incheckningar inom två fönster från den senaste, för jämförelsen av fönstren
+        self.recent_days = np.empty(0, dtype=np.int64)
+        self.recent_feelings = np.empty(0, dtype=np.int64)
+
+    @property
+    def feelings(self):
+        return sorted(self.feeling_codes, key=self.feeling_codes.get)
+
+    @property
+    def phases(self):
+        return sorted(self.phase_codes, key=self.phase_codes.get)
+
+    def add_rollup(self, rollup):
+        """Räknar in hoprullade månader (se storage.rollup_checkins)
+
+        Bara känsla × fas och månad × känsla går att räkna på månadsaggregat, övergångar,
+        veckodagar och uppehåll bygger på de incheckningar som finns kvar i historiken.
+        """
+        if not rollup["months"]:
+            return
+        months, feelings, phases, counts = (np.array(column) for column in zip(*rollup["months"]))
+        feelings = np.array([self.feeling_codes.setdefault(name, len(self.feeling_codes)) for name in feelings])
+        phases = np.array([self.phase_codes.setdefault(name, len(self.phase_codes)) for name in phases])
+        empty = np.empty(0, dtype=np.int64)
+        self.update(empty, empty, empty)
+
+        np.add.at(self.pairs, (feelings, phases), counts)
+        month = months.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64) % 12
+        np.add.at(self.months, (month, feelings), counts)
+
+    def update_batches(self, batches):
+        """Räknar in historikens Arrow-batchar, returnerar False om de inte kommer i datumordning"""
+        for batch in batches:
+            days = batch.column("day").to_numpy(zero_copy_only=False).astype(np.int64)
+            feelings = dictionary_codes(batch.column("feeling"), self.feeling_codes)
+            phases = dictionary_codes(batch.column("phase"), self.phase_codes)
+            if not self.update(days, feelings, phases):
+                return False
+        return True
+
+    def update(self, days, feelings, phases):
+        """Räknar in nya incheckningar, givna som dagnummer och index för känsla och fas
+
+        Incheckningar bakåt i tiden kan inte räknas in stegvis, då returneras False
+        och mönstren får räknas om från början.
+        """
+        n_feelings, n_phases = len(self.feeling_codes), len(self.phase_codes)
+        self.pairs = _grow(self.pairs, (n_feelings, n_phases))
+        self.transitions = _grow(self.transitions, (n_feelings, n_feelings))
+        self.weekdays = _grow(self.weekdays, (7, n_feelings))
+        self.months = _grow(self.months, (12, n_feelings))
+        self.day_feelings = _grow(self.day_feelings, (n_feelings,))
+        self.breaks = _grow(self.breaks, (n_feelings,))
+
+        if days.size == 0:
+            return True
+        previous = np.concatenate(([days[0] if self.last_day is None else self.last_day], days[:-1]))
+        if np.any(days < previous):
+            return False
+
+        self.pairs += _count(feelings * n_phases + phases, n_feelings * n_phases).reshape(n_feelings, n_phases)
+
+        # Övergångarna fortsätter från den sista incheckningen i förra uppdateringen
+        chain = feelings if self.last_feeling is None else np.concatenate(([self.last_feeling], feelings))
+        self.transitions += _count(chain[:-1] * n_feelings + chain[1:], n_feelings ** 2).reshape(n_feelings, n_feelings)
+
+        weekday = (days + WEEK_OFFSET) % 7
+        self.weekdays += _count(weekday * n_feelings + feelings, 7 * n_feelings).reshape(7, n_feelings)
+        month = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64) % 12
+        self.months += _count(month * n_feelings + feelings, 12 * n_feelings).reshape(12, n_feelings)
+
+        # En dag räknas när den är avslutad, dvs. när en senare dag har en incheckning.
+        # Dagens sista känsla avgör, och ett hopp på mer än en dag är ett uppehåll
+        all_days = days if self.last_day is None else np.concatenate(([self.last_day], days))
+        last_of_day = np.append(all_days[1:] != all_days[:-1], True)
+        day_list, day_feeling = all_days[last_of_day], chain[last_of_day]
+        finished = day_feeling[:-1]
+        self.day_feelings += _count(finished, n_feelings)
+        self.breaks += _count(finished[np.diff(day_list) > 1], n_feelings)
+
+        self.last_day = int(days[-1])
+        self.last_feeling = int(feelings[-1])
+        keep = np.concatenate((self.recent_days, days)) > self.last_day - 2 * WINDOW
+        self.recent_days = np.concatenate((self.recent_days, days))[keep]
+        self.recent_feelings = np.concatenate((self.recent_feelings, feelings))[keep]
+        self.rows += days.size
+        return True
+
+    def phase_given_feeling(self):
+        """Returnerar känsla × fas som andelar per känsla"""
+        return _shares(self.pairs)
+
+    def next_feeling(self):
+        """Returnerar övergångsmatrisen känsla → nästa känsla som andelar per rad"""
+        return _shares(self.transitions)
+
+    def messages(self):
+        """Returnerar de personliga insikterna som meningar, de tydligaste först"""
+        found = []
+        feelings, phases = self.feelings, self.phases
+        if self.pairs.sum() < MIN_SUPPORT:
+            return []
+
+        # Känsla -> fas: vilken fas som oftast följer med användarens vanligaste känsla
+        totals = self.pairs.sum(axis=1)
+        top = int(np.argmax(totals))
+        phase = int(np.argmax(self.pairs[top]))
+        share = self.pairs[top, phase] / totals[top]
+        found.append((share, f"När du känner dig **{feelings[top]}** väljer du oftast en "
+                             f"**{phases[phase]}**-fas ({share:.0%} av gångerna)"))
+
+        # Känsla -> nästa känsla, utifrån den senaste incheckningen
+        # Utan incheckningar kvar i historiken (bara hoprullade månader) finns ingen senaste känsla
+        row = self.transitions[self.last_feeling] if self.last_feeling is not None else np.zeros(0)
+        if row.sum() >= MIN_SUPPORT:
+            following = int(np.argmax(row))
+            share = row[following] / row.sum()
+            found.append((share, f"När du känt dig **{feelings[self.last_feeling]}** brukar nästa incheckning "
+                                 f"vara **{feelings[following]}** ({share:.0%})"))
+
+        # Veckodagar och årstider där en känsla är klart vanligare än annars
+        seasons = _seasons(self.months)
+        for counts, names, text in ((self.weekdays, WEEKDAYS, "På {name} känner du dig oftare **{feeling}**"),
+                                    (seasons, SEASONS, "Under {name} känner du dig oftare **{feeling}**")):
+            cell = _strongest_lift(counts)
+            if cell is not None:
+                (group, feeling), lift, share, base = cell
+                found.append((lift - 1, text.format(name=names[group], feeling=feelings[feeling])
+                              + f" ({share:.0%} mot {base:.0%} annars)"))
+
+        # Förändring: senaste fönstret jämfört med fönstret före
+        shift = self._window_shift()
+        if shift is not None:
+            feeling, now, before = shift
+            found.append((now - before, f"De senaste {WINDOW} dagarna har du känt dig **{feelings[feeling]}** "
+                                        f"oftare än tidigare ({now:.0%} mot {before:.0%})"))
+
+        # Streakbrott: dagar med en viss känsla som oftare följs av ett uppehåll
+        days_total = self.day_feelings.sum()
+        if days_total >= MIN_SUPPORT and self.breaks.sum():
+            base = self.breaks.sum() / days_total
+            rates = np.divide(self.breaks, self.day_feelings, out=np.zeros(len(self.breaks)),
+                              where=self.day_feelings >= MIN_SUPPORT)
+            feeling = int(np.argmax(rates))
+            if rates[feeling] >= base * MIN_LIFT:
+                found.append((rates[feeling] / base - 1,
+                              f"Dagar då du känner dig **{feelings[feeling]}** följs oftare av ett uppehåll "
+                              f"({rates[feeling]:.0%} mot {base:.0%}), en extra påminnelse då kan hjälpa din streak"))
+
+        return [text for _, text in sorted(found, key=lambda item: item[0], reverse=True)]
+
+    def _window_shift(self):
+        if self.last_day is None:
+            return None
+        recent = self.recent_days > self.last_day - WINDOW
+        now = _count(self.recent_feelings[recent], len(self.feeling_codes))
+        before = _count(self.recent_feelings[~recent], len(self.feeling_codes))
+        if now.sum() < MIN_SUPPORT or before.sum() < MIN_SUPPORT:
+            return None
+        change = now / now.sum() - before / before.sum()
+        feeling = int(np.argmax(change))
+        if change[feeling] < MIN_SHIFT:
+            return None
+        return feeling, now[feeling] / now.sum(), before[feeling] / before.sum()
+
+
+def _shares(counts):
+    totals = counts.sum(axis=1, keepdims=True)
+    return np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+
+
+def _seasons(months):
+    # December räknas till vintern, så månaderna flyttas ett steg innan de delas i tre
+    return np.roll(months, 1, axis=0).reshape(4, 3, -1).sum(axis=1)
+
+
+def _strongest_lift(counts):
+    """Returnerar ((grupp, känsla), lyft, andel, andel annars) för den tydligaste avvikelsen"""
+    totals = counts.sum(axis=1, keepdims=True)
+    others = counts.sum(axis=0, keepdims=True) - counts
+    other_totals = totals.sum() - totals
+    share = np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+    base = np.divide(others, other_totals, out=np.zeros(counts.shape), where=other_totals > 0)
+    lift = np.divide(share, base, out=np.zeros(counts.shape), where=base > 0)
+    lift[(counts < MIN_SUPPORT) | (np.broadcast_to(other_totals, counts.shape) < MIN_SUPPORT)] = 0
+    if lift.size == 0 or lift.max() < MIN_LIFT:
+        return None
+    cell = np.unravel_index(int(np.argmax(lift)), lift.shape)
+    return (int(cell[0]), int(cell[1])), float(lift[cell]), float(share[cell]), float(base[cell])
+
+
+class InsightCache:
+    """Processgemensam cache med mönstren per användare, uppdateras med bara nya incheckningar
+
+    Varje användare har ett eget lås, så en omräkning för en användare får inte andras
+    trendvyer att vänta. Sessionerna får de färdiga insikterna, aldrig räknematriserna
+    som en annan session kan hålla på att uppdatera.
+    """
+
+    def __init__(self, storage, max_users=256):
+        self.storage = storage
+        self.max_users = max_users
+        # Användare -> (hoprullningens generation, Insights, insikterna som meningar)
+        self._entries = collections.OrderedDict()
+        self._user_locks = {}
+        self._lock = threading.Lock()
+
+    def messages(self, user, snapshot):
+        """Returnerar insikterna för minst de incheckningar som snapshoten räknar med"""
+        # Historiken börjar om efter en hoprullning, då börjar mönstren också om
+        generation = snapshot.get("rollup_generation", 0)
+        rows = snapshot["data_version"] - snapshot.get("rolled_up", 0)
+        with self._lock:
+            user_lock = self._user_locks.setdefault(user, threading.Lock())
+        with user_lock:
+            with self._lock:
+                entry = self._entries.get(user)
+            if entry is not None and entry[0] == generation and entry[1].rows >= rows:
+                messages = entry[2]
+            else:
+                if entry is not None and entry[0] == generation:
+                    # Det som ligger i cachen ändras aldrig, uppdateringen görs på en kopia
+                    insights = copy.deepcopy(entry[1])
+                else:
+                    insights = self._start(user)
+                if insights.rows < rows:
+                    batches = self.storage.iter_history(user, start=insights.rows)
+                    if not insights.update_batches(batches):
+                        # En incheckning bakåt i tiden, då räknas allt om i datumordning
+                        insights = self._start(user)
+                        insights.update_batches(_sorted_batches(self.storage.iter_history(user)))
+                messages = tuple(insights.messages())
+                entry = (generation, insights, messages)
+            with self._lock:
+                self._entries[user] = entry
+                self._entries.move_to_end(user)
+                while len(self._entries) > self.max_users:
+                    evicted, _ = self._entries.popitem(last=False)
+                    self._user_locks.pop(evicted, None)
+        return messages
+
+    def _start(self, user):
+        insights = Insights()
+        insights.add_rollup(self.storage.rollups(user))
+        return insights
+
+
+def _sorted_batches(batches):
+    import pyarrow as pa
+    batches = list(batches)
+    if not batches:
+        return []
+    table = pa.Table.from_batches(batches).unify_dictionaries()
+    # Stabil sortering på dag, så ordningen inom en dag är den som incheckningarna kom i
+    return table.take(np.argsort(table.column("day").to_numpy(), kind="stable")).combine_chunks().to_batches()
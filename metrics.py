@@ -0,0 +1,166 @@
+import bisect
+import contextlib
+import functools
+import http.server
+import logging
+import os
+import threading
+import time
+
+# Mätningen slås på med LIVSPULS_METRICS=1, avstängd kostar den ingenting
+ENABLED = os.environ.get("LIVSPULS_METRICS", "") not in ("", "0")
+LOG_INTERVAL = float(os.environ.get("LIVSPULS_METRICS_LOG_INTERVAL", "60"))
+
+# Gränserna (sekunder) i histogrammet som visas i Prometheus-formatet
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("livspuls.metrics")
+
+_lock = threading.Lock()
+_stages = {}
+_counters = {}
+_last_log = time.monotonic()
+_server = None
+
+
+class _Stage:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+
+def record(name, seconds):
+    """Lägger till en tidmätning för ett steg"""
+    with _lock:
+        stage = _stages.get(name)
+        if stage is None:
+            stage = _stages[name] = _Stage()
+        stage.count += 1
+        stage.total += seconds
+        stage.max = max(stage.max, seconds)
+        stage.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+
+def count(name, amount=1):
+    """Räknar upp en händelseräknare"""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+@contextlib.contextmanager
+def _timing(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+_disabled = contextlib.nullcontext()
+
+
+def stage(name):
+    """Context manager som tidtar ett steg, t.ex. with stage("trend.figures"): ..."""
+    return _timing(name) if ENABLED else _disabled
+
+
+def timed(name):
+    """Dekorator som tidtar varje anrop, avstängd returneras funktionen orörd"""
+    def decorate(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _timing(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def snapshot():
+    """Returnerar en kopia av alla mätningar som {"stages": ..., "counters": ...}"""
+    with _lock:
+        stages = {name: {"count": s.count, "total_s": s.total, "max_s": s.max,
+                         "mean_ms": s.total / s.count * 1000 if s.count else 0.0,
+                         "buckets": list(s.buckets)}
+                  for name, s in _stages.items()}
+        return {"stages": stages, "counters": dict(_counters)}
+
+
+def render_prometheus():
+    """Returnerar mätningarna i Prometheus textformat"""
+    data = snapshot()
+    lines = [
+        "# HELP livspuls_stage_seconds Tid per steg i appen",
+        "# TYPE livspuls_stage_seconds histogram"
+    ]
+    for name, s in sorted(data["stages"].items()):
+        cumulative = 0
+        for bound, amount in zip(BUCKETS + ("+Inf",), s["buckets"]):
+            cumulative += amount
+            lines.append(f'livspuls_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'livspuls_stage_seconds_sum{{stage="{name}"}} {s["total_s"]:.6f}')
+        lines.append(f'livspuls_stage_seconds_count{{stage="{name}"}} {s["count"]}')
+    lines += [
+        "# HELP livspuls_events_total Antal händelser",
+        "# TYPE livspuls_events_total counter"
+    ]
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f'livspuls_events_total{{event="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def log_line():
+    """Returnerar alla mätningar sammanfattade på en rad"""
+    data = snapshot()
+    parts = [f"{name} n={s['count']} mean={s['mean_ms']:.1f}ms max={s['max_s'] * 1000:.1f}ms"
+             for name, s in sorted(data["stages"].items())]
+    parts += [f"{name}={value}" for name, value in sorted(data["counters"].items())]
+    return "livspuls metrics: " + "; ".join(parts)
+
+
+def maybe_log():
+    """Loggar en sammanfattning om det gått LOG_INTERVAL sekunder sedan förra gången"""
+    global _last_log
+    if not ENABLED:
+        return
+    now = time.monotonic()
+    with _lock:
+        if now - _last_log < LOG_INTERVAL:
+            return
+        _last_log = now
+    logger.info(log_line())
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port):
+    """Startar en /metrics-endpoint för Prometheus i en bakgrundstråd, en gång per process"""
+    global _server
+    with _lock:
+        if _server is not None or not ENABLED:
+            return _server
+        _server = http.server.ThreadingHTTPServer(("", port), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name="livspuls-metrics", daemon=True).start()
+    return _server
@@ -0,0 +1,95 @@
+"""Rullar ihop incheckningar äldre än lagringstiden till månadsaggregat
+
+    python retention.py --storage journal --data-dir livspuls_data --keep-days 365
+
+Räknarna i sidhuvudet (antal incheckningar, streak och högsta streak) påverkas inte,
+och månadsaggregaten räknas fortfarande med i trendanalysen och insikterna.
+"""
+import argparse
+import datetime
+import logging
+import os
+import sys
+import threading
+import time
+
+import metrics
+
+# Hur många dagar enskilda incheckningar sparas, 0 sparar allt
+RETENTION_DAYS = int(os.environ.get("LIVSPULS_RETENTION_DAYS", "0"))
+# Hur ofta (sekunder) bakgrundstråden letar efter incheckningar att rulla ihop
+INTERVAL = float(os.environ.get("LIVSPULS_ROLLUP_INTERVAL", "3600"))
+
+logger = logging.getLogger("livspuls.retention")
+
+_lock = threading.Lock()
+_thread = None
+
+
+def cutoff_day(keep_days, today=None):
+    """Returnerar första dagen som sparas som enskilda incheckningar
+
+    Gränsen läggs på en månadsstart, så varje månad finns antingen hoprullad eller i historiken.
+    """
+    # streaks drar in numpy, och appen importerar den här modulen vid start
+    from streaks import day_number
+    oldest = (today or datetime.date.today()) - datetime.timedelta(days=keep_days)
+    return day_number(oldest.replace(day=1))
+
+
+def rollup_all(storage, keep_days=RETENTION_DAYS, today=None):
+    """Rullar ihop alla användares gamla incheckningar, returnerar hur många som rullades ihop"""
+    if keep_days <= 0:
+        return 0
+    cutoff = cutoff_day(keep_days, today)
+    rolled = 0
+    with metrics.stage("retention"):
+        for user in storage.users():
+            before = storage.load(user).get("rolled_up", 0)
+            # Varje användare rullas ihop för sig, så ett fel stoppar inte de andra
+            try:
+                rolled += storage.rollup(user, cutoff).get("rolled_up", 0) - before
+            except Exception:
+                logger.exception("Kunde inte rulla ihop incheckningarna för %s", user)
+    metrics.count("retention.rolled_up", rolled)
+    return rolled
+
+
+def start(storage, keep_days=RETENTION_DAYS, interval=INTERVAL):
+    """Rullar ihop gamla incheckningar i en bakgrundstråd, en gång per process"""
+    global _thread
+    with _lock:
+        if _thread is not None or keep_days <= 0:
+            return _thread
+        _thread = threading.Thread(target=_run, args=(storage, keep_days, interval), name="livspuls-retention",
+                                   daemon=True)
+    _thread.start()
+    return _thread
+
+
+def _run(storage, keep_days, interval):
+    while True:
+        try:
+            rollup_all(storage, keep_days)
+        except Exception:
+            logger.exception("Hoprullningen av gamla incheckningar misslyckades")
+        time.sleep(interval)
+
+
+def main(argv=None):
+    from storage import open_storage
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--storage", default=os.environ.get("LIVSPULS_STORAGE", "journal"))
+    parser.add_argument("--data-dir", default=os.environ.get("LIVSPULS_DATA_DIR", "livspuls_data"))
+    parser.add_argument("--keep-days", type=int, default=RETENTION_DAYS or 365,
+                        help="Hur många dagar enskilda incheckningar sparas")
+    parser.add_argument("--today", type=datetime.date.fromisoformat, default=None,
+                        help="Datum som lagringstiden räknas från, standard är idag")
+    args = parser.parse_args(argv)
+
+    rolled = rollup_all(open_storage(args.storage, args.data_dir), args.keep_days, args.today)
+    print(f"{rolled} incheckningar rullades ihop till månadsaggregat", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1284 @@
+import collections
+import contextlib
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+
+# numpy, pyarrow och pandas importeras i funktionerna som använder dem. Att läsa
+# snapshoten och lägga till en incheckning behöver dem inte, så appen startar snabbare
+
+try:
+    import fcntl
+except ImportError:  # Windows saknar fcntl, där skyddar bara trådlåset
+    fcntl = None
+
+# Filer som lagringen använder i sin datakatalog
+JOURNAL_FILE = "journal.jsonl"
+SNAPSHOT_FILE = "snapshot.json"
+HISTORY_FILE = "history.arrow"
+REFLECTIONS_FILE = "reflections.sqlite"
+LOCK_FILE = ".lock"
+SQLITE_FILE = "livspuls.sqlite"
+LEGACY_STREAK_FILE = "lindas_streak_data.json"
+LEGACY_LOG_FILE = "lindas_livspuls_logg.txt"
+
+# Användaren som ärver data från den tiden appen bara hade en användare
+DEFAULT_USER = "linda"
+USER_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# Nycklar i snapshoten som hör till trendanalysens aggregat
+AGGREGATE_KEYS = ("data_version", "feeling_counts", "phase_counts", "combo_counts")
+
+# Hur många journalposter som får samlas innan de flyttas till historikfilen
+COMPACT_EVERY = 200
+
+
+def empty_snapshot():
+    """Returnerar en tom snapshot med streak-räknarna"""
+    return {
+        "current_streak": 0,
+        "last_check_in": "",
+        "highest_streak": 0,
+        "total_check_ins": 0,
+        "journal_generation": 0,  # Vilken journalfil som är aktuell
+        "journal_offset": 0,      # Hur långt in i journalen snapshoten gäller
+        "pending": 0,             # Journalposter efter journal_offset
+        "history_rows": 0,        # Incheckningar som flyttats till historikfilen
+        "rollup_generation": 0,   # Ökar varje gång gamla incheckningar rullas ihop
+        "rolled_up": 0,           # Incheckningar som bara finns kvar som månadsaggregat
+        "first_check_in": "",     # Äldsta incheckningen som inte rullats ihop
+        # Aggregat för trendanalysen, uppdateras vid varje incheckning
+        "data_version": 0,
+        "feeling_counts": {},
+        "phase_counts": {},
+        "combo_counts": {}
+    }
+
+
+def make_checkin(feeling, energy_phase, when=None):
+    """Skapar en journalpost för en incheckning"""
+    when = when or datetime.datetime.now()
+    return {
+        "ts": when.isoformat(timespec="seconds"),
+        "date": when.date().isoformat(),
+        "feeling": feeling,
+        "phase": energy_phase
+    }
+
+
+def apply_checkin(snapshot, record):
+    """Uppdaterar streak-räknarna i snapshoten med en incheckning"""
+    today = datetime.date.fromisoformat(record["date"])
+    yesterday = (today - datetime.timedelta(days=1)).isoformat()
+    today = today.isoformat()
+
+    # Uppdatera total antal incheckningar
+    snapshot["total_check_ins"] += 1
+    apply_aggregates(snapshot, record)
+    if not snapshot.get("first_check_in") or today < snapshot["first_check_in"]:
+        snapshot["first_check_in"] = today
+
+    # En incheckning bakåt i tiden (t.ex. från en import) kan inte räknas in stegvis,
+    # då markeras streaken för omräkning från historiken i stället
+    if snapshot["last_check_in"] and today < snapshot["last_check_in"]:
+        snapshot["streaks_stale"] = True
+        return snapshot
+
+    # Om detta är första incheckningen eller om sista incheckningen var igår
+    if snapshot["last_check_in"] == "" or snapshot["last_check_in"] == yesterday:
+        snapshot["current_streak"] += 1
+    # Om sista incheckningen var idag, ändra ingenting
+    elif snapshot["last_check_in"] == today:
+        pass
+    # Annars, återställ streak till 1
+    else:
+        snapshot["current_streak"] = 1
+
+    # Uppdatera högsta streak om aktuell streak är högre
+    if snapshot["current_streak"] > snapshot["highest_streak"]:
+        snapshot["highest_streak"] = snapshot["current_streak"]
+
+    # Uppdatera datum för senaste incheckning
+    snapshot["last_check_in"] = today
+    return snapshot
+
+
+def recalculate_streaks(snapshot, days, rolled_days=()):
+    """Sätter streak-räknarna i snapshoten utifrån alla incheckningsdagar
+
+    days har en dag per incheckning i historiken, rolled_days en per dag som rullats ihop.
+    """
+    import numpy as np
+    from streaks import compute_streaks, day_date
+    snapshot.update(compute_streaks(np.concatenate([np.asarray(rolled_days, dtype=np.int32),
+                                                    np.asarray(days, dtype=np.int32)])))
+    snapshot["total_check_ins"] = len(days) + snapshot.get("rolled_up", 0)
+    snapshot["first_check_in"] = day_date(np.min(days)).isoformat() if len(days) else ""
+    snapshot.pop("streaks_stale", None)
+    return snapshot
+
+
+def apply_aggregates(snapshot, record):
+    """Räknar in en incheckning i trendanalysens aggregat"""
+    feeling = record["feeling"]
+    phase = record["phase"]
+    combo = f"{feeling} + {phase}"
+
+    snapshot["feeling_counts"][feeling] = snapshot["feeling_counts"].get(feeling, 0) + 1
+    snapshot["phase_counts"][phase] = snapshot["phase_counts"].get(phase, 0) + 1
+    snapshot["combo_counts"][combo] = snapshot["combo_counts"].get(combo, 0) + 1
+
+    # Versionen används som nyckel för cachade grafer
+    snapshot["data_version"] += 1
+    return snapshot
+
+
+# Lås inom processen, flock räcker inte mellan trådar på alla plattformar
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Tar ett exklusivt rådgivande lås på filen, både mellan trådar och processer"""
+    key = os.path.abspath(path)
+    with _thread_locks_lock:
+        thread_lock = _thread_locks.setdefault(key, threading.Lock())
+
+    with thread_lock:
+        os.makedirs(os.path.dirname(key), exist_ok=True)
+        with open(key, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def checkins_frame(records):
+    """Gör om incheckningar till en kolumnär tabell med en rad per incheckning"""
+    # pandas behövs bara när det gamla JSON-formatet flyttas över, så importen får vänta tills dess
+    import pandas as pd
+    frame = pd.DataFrame.from_records(records, columns=["date", "feeling", "phase"])
+    frame["feeling"] = frame["feeling"].astype("category")
+    frame["phase"] = frame["phase"].astype("category")
+    return frame
+
+
+def aggregate_checkins(frame):
+    """Räknar fram trendanalysens aggregat ur en tabell med incheckningar
+
+    Allt kommer från en enda groupby på (datum, känsla, fas), så känsla och fas
+    räknas alltid ihop per incheckning och aldrig genom en join på datum.
+    """
+    aggregates = {key: {} for key in AGGREGATE_KEYS}
+    aggregates["data_version"] = len(frame)
+    if frame.empty:
+        return aggregates
+
+    sizes = frame.groupby(["date", "feeling", "phase"], observed=True).size().reset_index(name="count")
+    sizes["combo"] = sizes["feeling"].astype(str) + " + " + sizes["phase"].astype(str)
+
+    aggregates["feeling_counts"] = sizes.groupby("feeling", observed=True)["count"].sum().astype(int).to_dict()
+    aggregates["phase_counts"] = sizes.groupby("phase", observed=True)["count"].sum().astype(int).to_dict()
+    aggregates["combo_counts"] = sizes.groupby("combo")["count"].sum().astype(int).to_dict()
+    return aggregates
+
+
+def history_table(records):
+    """Gör om incheckningar till en kompakt Arrow-tabell
+
+    Dagen lagras som int32 (dagar sedan 1970-01-01) och känsla och fas som
+    ordlistekodade kategorier, så en incheckning tar bara några byte.
+    """
+    import pyarrow as pa
+
+    # Kategorierna i historikfilen, int8-index räcker gott för känslor och faser
+    category = pa.dictionary(pa.int8(), pa.string())
+    dates = pa.array([record["date"] for record in records], pa.string())
+    feelings = pa.array([record["feeling"] for record in records], pa.string())
+    phases = pa.array([record["phase"] for record in records], pa.string())
+    return pa.table({
+        "day": dates.cast(pa.date32()).cast(pa.int32()),
+        "feeling": feelings.dictionary_encode().cast(category),
+        "phase": phases.dictionary_encode().cast(category)
+    })
+
+
+def history_frame(table):
+    """Gör om en Arrow-tabell med historik till en DataFrame med datum, känsla och fas"""
+    import pandas as pd
+    frame = table.to_pandas()
+    frame.insert(0, "date", pd.to_datetime(frame.pop("day").astype("int64"), unit="D"))
+    return frame
+
+
+def empty_rollup():
+    """Returnerar ett tomt månadsaggregat för hoprullade incheckningar"""
+    return {
+        "months": [],  # [första dagen i månaden, känsla, fas, antal]
+        "runs": []     # [startdag, längd] för varje följd av incheckningsdagar
+    }
+
+
+def rollup_checkins(table, rollup=None):
+    """Rullar ihop en historiktabell till antal per (månad, känsla, fas) och lägger till i rollup
+
+    Incheckningsdagarna sparas som följder, så streak-räknarna kan räknas om exakt
+    även när de enskilda incheckningarna är borta.
+    """
+    import numpy as np
+    import pyarrow as pa
+    from streaks import runs
+
+    rollup = rollup or empty_rollup()
+    days = table.column("day").to_numpy()
+    months = days.astype("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+    grouped = pa.table({"month": months, "feeling": table.column("feeling").cast(pa.string()),
+                        "phase": table.column("phase").cast(pa.string())}).group_by(
+        ["month", "feeling", "phase"]).aggregate([("month", "count")])
+
+    counts = collections.Counter({(month, feeling, phase): count for month, feeling, phase, count in rollup["months"]})
+    for row in grouped.to_pylist():
+        counts[(row["month"], row["feeling"], row["phase"])] += row["month_count"]
+    rollup["months"] = [[month, feeling, phase, count] for (month, feeling, phase), count in sorted(counts.items())]
+
+    starts, lengths = runs(np.concatenate([rollup_days(rollup), days]))
+    rollup["runs"] = [[int(start), int(length)] for start, length in zip(starts, lengths)]
+    return rollup
+
+
+def has_checkins_before(snapshot, cutoff_day):
+    """Returnerar om användaren kan ha incheckningar före cutoff_day (dagnummer) som inte rullats ihop"""
+    from streaks import day_number
+    first = snapshot.get("first_check_in")
+    # Utan fältet får historiken avgöra
+    if first is None:
+        return True
+    return first != "" and day_number(first) < cutoff_day
+
+
+def rollup_days(rollup):
+    """Returnerar de hoprullade incheckningsdagarna, en per dag"""
+    import numpy as np
+    if not rollup["runs"]:
+        return np.empty(0, dtype=np.int32)
+    starts, lengths = np.asarray(rollup["runs"], dtype=np.int64).T
+    # Varje följd blir start, start + 1, ..., start + längd - 1
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return (np.repeat(starts, lengths) + offsets).astype(np.int32)
+
+
+class CheckinJournal:
+    """Append-only journal för incheckningar med en liten snapshot för streak-räknarna
+
+    Varje incheckning skrivs som en JSON-rad i journalen och fsync:as direkt.
+    Snapshoten innehåller bara räknarna och hur långt in i journalen de gäller,
+    så en incheckning kostar lika mycket oavsett hur lång historiken är.
+
+    Vid komprimering flyttas journalen in i en kolumnär historikfil (Arrow IPC)
+    och en ny journal påbörjas. Historiken läses bara, minnesmappad, när någon
+    faktiskt behöver den, räknarna i sidhuvudet kommer direkt från snapshoten.
+    Incheckningar äldre än lagringstiden rullas ihop till månadsaggregat, då
+    skrivs historiken och aggregaten som en ny generation av filerna.
+
+    Alla skrivningar görs under ett fillås och utgår från det som ligger på disk,
+    så samtidiga incheckningar från flera sessioner eller processer går inte förlorade.
+    """
+
+    def __init__(self, directory, legacy_file=LEGACY_STREAK_FILE, compact_every=COMPACT_EVERY):
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.lock_path = os.path.join(directory, LOCK_FILE)
+        self.legacy_file = legacy_file
+        self.compact_every = compact_every
+
+    def journal_path(self, generation):
+        """Returnerar sökvägen till journalen för en generation"""
+        if generation == 0:
+            return os.path.join(self.directory, JOURNAL_FILE)
+        return os.path.join(self.directory, f"journal.{generation}.jsonl")
+
+    def history_path(self, generation):
+        """Returnerar sökvägen till historikfilen för en generation av hoprullningen"""
+        if generation == 0:
+            return os.path.join(self.directory, HISTORY_FILE)
+        return os.path.join(self.directory, f"history.{generation}.arrow")
+
+    def rollup_path(self, generation):
+        """Returnerar sökvägen till månadsaggregaten för en generation av hoprullningen"""
+        return os.path.join(self.directory, f"rollup.{generation}.json")
+
+    def load(self):
+        """Läser snapshoten och spelar upp journalposterna som skrivits efter den"""
+        # Journalen kan bytas ut av en komprimering medan vi läser, då läser vi om snapshoten
+        while True:
+            snapshot = self._read_snapshot()
+            if snapshot is None:
+                # En läsning skapar ingen användare, det gör första skrivningen
+                if not (self.legacy_file and os.path.exists(self.legacy_file)):
+                    return empty_snapshot()
+                with file_lock(self.lock_path):
+                    return self._load_locked()
+            try:
+                return self._replay(snapshot)
+            except FileNotFoundError:
+                continue
+
+    def create(self):
+        """Skapar snapshoten om den saknas, med data från det gamla JSON-formatet"""
+        if not os.path.exists(self.snapshot_path):
+            with file_lock(self.lock_path):
+                self._load_locked()
+
+    def _load_locked(self):
+        # En annan process kan ha hunnit migrera medan vi väntade på låset
+        return self._replay(self._read_snapshot() or self._migrate_legacy())
+
+    def _replay(self, snapshot):
+        offset = snapshot["journal_offset"]
+        for record, offset in self._read_journal(snapshot, offset):
+            apply_checkin(snapshot, record)
+            snapshot["pending"] += 1
+        snapshot["journal_offset"] = offset
+        return snapshot
+
+    def append(self, record):
+        """Lägger till en incheckning i journalen och returnerar uppdaterade räknare"""
+        return self.append_many([record])
+
+    def append_many(self, records):
+        """Lägger till flera incheckningar med en enda skrivning och fsync"""
+        with file_lock(self.lock_path):
+            # Läs om det som ligger på disk så att andra sessioners incheckningar räknas med
+            snapshot = self._load_locked()
+            journal_path = self.journal_path(snapshot["journal_generation"])
+            self._write_journal(journal_path, records)
+
+            for record in records:
+                apply_checkin(snapshot, record)
+            snapshot["journal_offset"] = os.path.getsize(journal_path)
+            snapshot["pending"] += len(records)
+
+            # Efter en incheckning bakåt i tiden räknas streaken om och sparas direkt,
+            # annars flyttas journalen till historiken då och då så att uppspelningen hålls kort
+            if snapshot.get("streaks_stale"):
+                recalculate_streaks(snapshot, self._days(snapshot), self._rolled_days(snapshot))
+                self._compact(snapshot)
+            elif snapshot["pending"] >= self.compact_every:
+                self._compact(snapshot)
+        return snapshot
+
+    def recalculate(self):
+        """Räknar om streak-räknarna från hela historiken, t.ex. efter en reparation"""
+        with file_lock(self.lock_path):
+            snapshot = self._load_locked()
+            recalculate_streaks(snapshot, self._days(snapshot), self._rolled_days(snapshot))
+            return self._compact(snapshot)
+
+    def rollup(self, cutoff_day):
+        """Rullar ihop incheckningar före cutoff_day (dagnummer) till månadsaggregat
+
+        Räknarna i snapshoten påverkas inte, de gäller fortfarande alla incheckningar.
+        """
+        import pyarrow as pa
+        from streaks import day_date
+        with file_lock(self.lock_path):
+            snapshot = self._load_locked()
+            # Oftast finns inget att rulla ihop, då skrivs ingenting och historiken läses inte
+            if not has_checkins_before(snapshot, cutoff_day):
+                return snapshot
+            snapshot = self._compact(snapshot)
+            table = self._history_table(snapshot)
+            old = table.column("day").to_numpy() < cutoff_day
+            rolled = table.filter(pa.array(old))
+            if rolled.num_rows == 0:
+                return snapshot
+
+            # Samma ordning som vid komprimering: de nya filerna skrivs först och
+            # snapshoten som pekar ut dem är det som gör hoprullningen giltig
+            generation = snapshot["rollup_generation"]
+            rollup = rollup_checkins(rolled, self._read_rollup(generation))
+            kept = table.filter(pa.array(~old))
+            self._write_json(self.rollup_path(generation + 1), rollup)
+            self._write_history(kept, generation + 1)
+            snapshot["rollup_generation"] = generation + 1
+            snapshot["rolled_up"] += rolled.num_rows
+            snapshot["history_rows"] = kept.num_rows
+            kept_days = kept.column("day").to_numpy()
+            snapshot["first_check_in"] = day_date(kept_days.min()).isoformat() if len(kept_days) else ""
+            self._write_snapshot(snapshot)
+
+            for path in (self.rollup_path(generation), self.history_path(generation)):
+                if os.path.exists(path):
+                    os.remove(path)
+        return snapshot
+
+    def rollups(self):
+        """Returnerar månadsaggregaten för de hoprullade incheckningarna"""
+        while True:
+            snapshot = self._read_snapshot() or empty_snapshot()
+            try:
+                return self._read_rollup(snapshot["rollup_generation"])
+            except FileNotFoundError:
+                continue
+
+    def _rolled_days(self, snapshot):
+        return rollup_days(self._read_rollup(snapshot["rollup_generation"]))
+
+    def _read_rollup(self, generation):
+        # Generation 0 har inget rullats ihop än
+        if generation == 0:
+            return empty_rollup()
+        with open(self.rollup_path(generation), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _days(self, snapshot):
+        """Returnerar dagnumret för varje incheckning i historiken och journalen"""
+        import numpy as np
+        from streaks import day_number
+        days = self._history_table(snapshot).column("day").to_numpy()
+        tail = [day_number(record["date"]) for record, _ in self._read_journal(snapshot, 0)]
+        return np.concatenate([days, np.asarray(tail, dtype=np.int32)])
+
+    def compact(self):
+        """Flyttar journalen in i historikfilen och skriver en ny snapshot"""
+        with file_lock(self.lock_path):
+            return self._compact(self._load_locked())
+
+    def _compact(self, snapshot):
+        import pyarrow as pa
+        generation = snapshot["journal_generation"]
+        records = [record for record, _ in self._read_journal(snapshot, 0)]
+
+        # Ordningen gör komprimeringen kraschsäker: historikfilen skrivs först men
+        # läses bara fram till history_rows, och den nya snapshoten pekar ut en ny journal
+        if records:
+            table = self._history_table(snapshot)
+            table = pa.concat_tables([table, history_table(records)]).unify_dictionaries().combine_chunks()
+            self._write_history(table, snapshot["rollup_generation"])
+            snapshot["history_rows"] = table.num_rows
+            snapshot["journal_generation"] = generation + 1
+            snapshot["journal_offset"] = 0
+            self._write_journal(self.journal_path(generation + 1), [])
+
+        snapshot["pending"] = 0
+        self._write_snapshot(snapshot)
+        if records:
+            os.remove(self.journal_path(generation))
+        return snapshot
+
+    def read_history(self):
+        """Returnerar alla incheckningar som en DataFrame med datum, känsla och fas, äldst först"""
+        return history_frame(self._full_history_table())
+
+    def iter_history(self, chunk_size, start=0):
+        """Ger historiken i bitar som Arrow-batchar, utan att läsa in allt i minnet"""
+        yield from self._full_history_table().slice(start).to_batches(max_chunksize=chunk_size)
+
+    def _full_history_table(self):
+        import pyarrow as pa
+        # Historikfilen och journalen efter den, tagna från samma snapshot
+        while True:
+            snapshot = self._read_snapshot() or empty_snapshot()
+            # En komprimering eller hoprullning kan ha tagit bort filerna efter att snapshoten lästes
+            try:
+                table = self._history_table(snapshot)
+                records = [record for record, _ in self._read_journal(snapshot, 0)]
+            except FileNotFoundError:
+                continue
+            if records:
+                table = pa.concat_tables([table, history_table(records)]).unify_dictionaries()
+            return table
+
+    def _history_table(self, snapshot):
+        """Läser historikfilen minnesmappad, bara de rader som snapshoten räknar med"""
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        rows = snapshot["history_rows"]
+        if rows == 0:
+            return history_table([])
+        # Tabellens buffertar pekar direkt in i mappningen och håller den vid liv
+        source = pa.memory_map(self.history_path(snapshot["rollup_generation"]))
+        return ipc.open_file(source).read_all().slice(0, rows)
+
+    def _write_history(self, table, generation):
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        history_path = self.history_path(generation)
+        tmp_path = f"{history_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, history_path)
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return None
+        with open(self.snapshot_path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        snapshot["pending"] = 0
+        snapshot.setdefault("journal_generation", 0)
+        snapshot.setdefault("history_rows", 0)
+        snapshot.setdefault("rollup_generation", 0)
+        snapshot.setdefault("rolled_up", 0)
+        return snapshot
+
+    def _write_snapshot(self, snapshot):
+        self._write_json(self.snapshot_path, snapshot)
+
+    def _write_json(self, path, data):
+        # Skriv till en temporär fil först så att en krasch aldrig lämnar en halv fil
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _read_journal(self, snapshot, offset):
+        """Läser snapshotens journal från en byte-offset och ger (post, offset efter posten)"""
+        journal_path = self.journal_path(snapshot["journal_generation"])
+        if snapshot["journal_generation"] == 0 and not os.path.exists(journal_path):
+            # Första generationen finns inte förrän den första incheckningen skrivits. Har den
+            # funnits (offset) eller har snapshoten på disk gått vidare till en ny journal har en
+            # komprimering tagit bort den, då ska den som anropar läsa om snapshoten och försöka igen
+            current = self._read_snapshot()
+            if snapshot["journal_offset"] == 0 and (current is None or current["journal_generation"] == 0):
+                return
+            raise FileNotFoundError(journal_path)
+        with open(journal_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                # En avbruten sista rad (t.ex. efter en krasch) hoppas över
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                yield json.loads(line), offset
+
+    def _write_journal(self, journal_path, records):
+        os.makedirs(self.directory, exist_ok=True)
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with open(journal_path, "ab") as f:
+            f.write(data.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _migrate_legacy(self):
+        """Flyttar över data från det gamla JSON-formatet till historikfilen"""
+        snapshot, records = read_legacy(self.legacy_file)
+        os.makedirs(self.directory, exist_ok=True)
+        if records:
+            self._write_history(history_table(records), snapshot["rollup_generation"])
+            snapshot["history_rows"] = len(records)
+        self._write_snapshot(snapshot)
+        return snapshot
+
+
+def read_legacy(legacy_file):
+    """Läser det gamla JSON-formatet och returnerar (snapshot, incheckningar)"""
+    snapshot = empty_snapshot()
+    legacy = {}
+    if legacy_file and os.path.exists(legacy_file):
+        with open(legacy_file, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+
+    # De gamla loggarna skrevs alltid parvis, en känsla och en fas per incheckning,
+    # så de slås ihop på position och inte på datum
+    records = [
+        {
+            "ts": feeling["date"] + "T00:00:00",
+            "date": feeling["date"],
+            "feeling": feeling["feeling"],
+            "phase": phase["phase"]
+        }
+        for feeling, phase in zip(legacy.get("feelings_log", []), legacy.get("phases_log", []))
+    ]
+    snapshot.update(aggregate_checkins(checkins_frame(records)))
+
+    # Räknarna tas över som de är, de kan inte alltid räknas fram ur loggarna
+    for key in ("current_streak", "last_check_in", "highest_streak", "total_check_ins"):
+        snapshot[key] = legacy.get(key, snapshot[key])
+    snapshot["first_check_in"] = min((record["date"] for record in records), default="")
+    return snapshot, records
+
+
+def check_user(user):
+    """Kontrollerar att användarnamnet går att använda som namnrymd i lagringen"""
+    if not USER_PATTERN.fullmatch(user or ""):
+        raise ValueError(f"Ogiltigt användarnamn: {user!r}")
+    return user
+
+
+# Fälten i den gamla textloggen och vad de heter i reflektionsposterna
+LOG_FIELDS = {
+    "Datum": "date",
+    "Känsla": "feeling",
+    "Energifas": "phase",
+    "Mikroaction": "microaction",
+    "Reflektion (Pep Talk)": "pep_talk",
+    "Cykelreflektionsfråga": "cycle_question",
+    "Lindas reflektion": "reflection"
+}
+REFLECTION_COLUMNS = ("date", "feeling", "phase", "microaction", "pep_talk", "cycle_question", "reflection")
+
+
+def parse_log_text(text):
+    """Tolkar den gamla textloggen och returnerar en reflektionspost per inlägg"""
+    entries = []
+    for block in re.split(r"^-{10,}$", text, flags=re.MULTILINE):
+        entry = {}
+        field = None
+        for line in block.strip("\n").split("\n"):
+            key, sep, value = line.partition(": ")
+            if sep and key in LOG_FIELDS:
+                field = LOG_FIELDS[key]
+                entry[field] = value
+            elif field is not None:
+                # Reflektioner kan sträcka sig över flera rader
+                entry[field] += "\n" + line
+        if "date" in entry:
+            entries.append(entry)
+    return entries
+
+
+# En anslutning per process och databasfil, delad mellan Streamlits sessionstrådar
+_sqlite_connections = {}
+_sqlite_schemas = set()
+_sqlite_connections_lock = threading.Lock()
+
+
+def sqlite_connection(path, schema):
+    """Returnerar processens anslutning till databasen och låset som skyddar den"""
+    key = (os.path.abspath(path), os.getpid())
+    with _sqlite_connections_lock:
+        if key not in _sqlite_connections:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Vänta hellre på andra processers skrivlås än att ge upp direkt
+            conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _sqlite_connections[key] = (conn, threading.Lock())
+        conn, lock = _sqlite_connections[key]
+
+        # Schemat körs en gång per anslutning, inte vid varje anrop
+        if (key, schema) not in _sqlite_schemas:
+            with lock:
+                conn.executescript(schema)
+            _sqlite_schemas.add((key, schema))
+    return conn, lock
+
+
+def sqlite_transaction(conn, func):
+    """Kör func i en skrivtransaktion och returnerar resultatet"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = func()
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return result
+
+
+class ReflectionIndex:
+    """Sökbar reflektionslogg i SQLite, med datumindex och fulltextindex (FTS5)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS reflections (
+            id INTEGER PRIMARY KEY,
+            user TEXT NOT NULL,
+            date TEXT NOT NULL,
+            feeling TEXT,
+            phase TEXT,
+            microaction TEXT,
+            pep_talk TEXT,
+            cycle_question TEXT,
+            reflection TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_reflections_user_date ON reflections (user, date);
+        CREATE TABLE IF NOT EXISTS reflection_imports (
+            user TEXT NOT NULL,
+            source TEXT NOT NULL,
+            PRIMARY KEY (user, source)
+        );
+    """
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS reflections_fts USING fts5(
+            user, feeling, phase, cycle_question, reflection,
+            content='reflections', content_rowid='id'
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn, self.lock = sqlite_connection(path, self.SCHEMA)
+        # Alla SQLite-byggen har inte FTS5, då faller sökningen tillbaka på LIKE
+        try:
+            sqlite_connection(path, self.FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+
+    def add(self, user, entry):
+        """Sparar en reflektion och returnerar dess id"""
+        with self.lock:
+            return sqlite_transaction(self.conn, lambda: self._insert(check_user(user), [entry]))
+
+    def add_many(self, user, entries, skip_duplicates=True, dry_run=False):
+        """Sparar flera reflektioner i en transaktion och hoppar över sådana som redan finns
+
+        En reflektion räknas som dubblett om datum, fråga och reflektionstext är desamma.
+        Returnerar hur många som sparades. Med dry_run rullas transaktionen tillbaka,
+        så svaret är hur många som skulle ha sparats.
+        """
+        user = check_user(user)
+
+        def write():
+            fresh = []
+            for entry in entries:
+                exists = skip_duplicates and self.conn.execute(
+                    "SELECT 1 FROM reflections WHERE user = ? AND date = ? "
+                    "AND IFNULL(cycle_question, '') = ? AND IFNULL(reflection, '') = ?",
+                    (user, entry["date"], entry.get("cycle_question") or "", entry.get("reflection") or "")
+                ).fetchone()
+                if not exists:
+                    self._insert(user, [entry])
+                    fresh.append(entry)
+            return len(fresh)
+
+        with self.lock:
+            if not dry_run:
+                return sqlite_transaction(self.conn, write)
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                return write()
+            finally:
+                self.conn.execute("ROLLBACK")
+
+    def iter_entries(self, user, chunk_size=10_000):
+        """Ger användarens reflektioner i bitar, äldst först"""
+        user = check_user(user)
+        columns = ", ".join(REFLECTION_COLUMNS)
+        last_id = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT id, {columns} FROM reflections WHERE user = ? AND id > ? ORDER BY id LIMIT ?",
+                    (user, last_id, chunk_size)
+                ).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [dict(zip(REFLECTION_COLUMNS, row[1:])) for row in rows]
+
+    def import_text(self, user, source, text):
+        """Importerar en gammal textlogg, varje källa importeras bara en gång"""
+        user = check_user(user)
+
+        def write():
+            done = self.conn.execute("SELECT 1 FROM reflection_imports WHERE user = ? AND source = ?",
+                                     (user, source)).fetchone()
+            if done:
+                return 0
+            entries = parse_log_text(text)
+            self._insert(user, entries)
+            self.conn.execute("INSERT INTO reflection_imports (user, source) VALUES (?, ?)", (user, source))
+            return len(entries)
+
+        with self.lock:
+            return sqlite_transaction(self.conn, write)
+
+    def search(self, user, query="", start=None, end=None, limit=50):
+        """Söker bland användarens reflektioner, nyast först
+
+        Med en sökfråga används fulltextindexet, annars bläddras det i datumindexet.
+        start och end är datum (ÅÅÅÅ-MM-DD) och tas med i intervallet.
+        """
+        user = check_user(user)
+        where = ["r.user = ?"]
+        params = [user]
+        if start:
+            where.append("r.date >= ?")
+            params.append(str(start))
+        if end:
+            where.append("r.date <= ?")
+            params.append(str(end))
+
+        terms = query.split()
+        if terms and self.fts:
+            # Varje ord citeras så att specialtecken i sökningen inte blir FTS-syntax
+            match = " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+            user_phrase = '"' + " ".join(re.findall(r"[A-Za-z0-9]+", user)) + '"'
+            # Träffarna tas fram ur fulltextindexet en gång, inte rad för rad
+            where.append("r.id IN (SELECT rowid FROM reflections_fts WHERE reflections_fts MATCH ?)")
+            # Sökorden matchas bara mot innehållet, inte mot kolumnen user
+            params.append(f"user : {user_phrase} AND {{feeling phase cycle_question reflection}} : ({match})")
+        elif terms:
+            for term in terms:
+                where.append("(r.reflection LIKE ? OR r.cycle_question LIKE ?)")
+                params += [f"%{term}%"] * 2
+
+        columns = ", ".join("r." + column for column in REFLECTION_COLUMNS)
+        sql = f"SELECT r.id, {columns} FROM reflections r WHERE {' AND '.join(where)} ORDER BY r.date DESC, r.id DESC LIMIT ?"
+        with self.lock:
+            rows = self.conn.execute(sql, params + [limit]).fetchall()
+        return [dict(zip(("id",) + REFLECTION_COLUMNS, row)) for row in rows]
+
+    def count(self, user):
+        """Returnerar hur många reflektioner användaren har sparat"""
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM reflections WHERE user = ?",
+                                     (check_user(user),)).fetchone()[0]
+
+    def _insert(self, user, entries):
+        row_id = None
+        for entry in entries:
+            values = [entry.get(column) for column in REFLECTION_COLUMNS]
+            row_id = self.conn.execute(
+                f"INSERT INTO reflections (user, {', '.join(REFLECTION_COLUMNS)}) VALUES (?{', ?' * len(values)})",
+                [user] + values
+            ).lastrowid
+            if self.fts:
+                self.conn.execute(
+                    "INSERT INTO reflections_fts (rowid, user, feeling, phase, cycle_question, reflection) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (row_id, user, entry.get("feeling"), entry.get("phase"),
+                     entry.get("cycle_question"), entry.get("reflection"))
+                )
+        return row_id
+
+
+# Användare vars gamla textloggar redan har kontrollerats i den här processen
+_imported_logs = set()
+_imported_logs_lock = threading.Lock()
+
+
+class Storage:
+    """Gränssnitt för lagring av incheckningar och reflektioner, med en namnrymd per användare"""
+
+    def load(self, user):
+        """Returnerar snapshoten med streak-räknare och aggregat för användaren"""
+        raise NotImplementedError
+
+    def append(self, user, record):
+        """Sparar en incheckning och returnerar den uppdaterade snapshoten"""
+        return self.append_many(user, [record])
+
+    def append_many(self, user, records):
+        """Sparar flera incheckningar i en skrivning och returnerar den uppdaterade snapshoten"""
+        raise NotImplementedError
+
+    def iter_history(self, user, chunk_size=50_000, start=0):
+        """Ger användarens incheckningar i bitar som Arrow-batchar (day, feeling, phase)
+
+        Med start hoppas de första incheckningarna över, t.ex. de som redan räknats in.
+        """
+        raise NotImplementedError
+
+    def read_history(self, user):
+        """Returnerar användarens alla incheckningar som en DataFrame, äldst först"""
+        raise NotImplementedError
+
+    def reflections(self):
+        """Returnerar reflektionsloggen som hör till lagringen"""
+        raise NotImplementedError
+
+    def legacy_logs(self, user):
+        """Ger (källa, text) för gamla textloggar som ska importeras till reflektionsloggen"""
+        if user == self.legacy_user and self.legacy_log_file and os.path.exists(self.legacy_log_file):
+            with open(self.legacy_log_file, "r", encoding="utf-8") as f:
+                yield os.path.abspath(self.legacy_log_file), f.read()
+
+    def save_reflection(self, user, entry):
+        """Sparar dagens session i användarens reflektionslogg"""
+        self.create_user(user)
+        return self.user_reflections(user).add(user, entry)
+
+    def save_reflections(self, user, entries):
+        """Sparar flera sessioner i en transaktion, i den ordning de kom"""
+        self.create_user(user)
+        return self.user_reflections(user).add_many(user, entries, skip_duplicates=False)
+
+    def search_reflections(self, user, query="", start=None, end=None, limit=50):
+        """Söker bland användarens reflektioner, se ReflectionIndex.search"""
+        return self.user_reflections(user).search(user, query, start, end, limit)
+
+    def user_reflections(self, user):
+        """Returnerar reflektionsloggen, med användarens gamla textloggar importerade"""
+        # Indexet skapas en gång per lagring, lagringen delas av hela processen
+        if getattr(self, "_reflection_index", None) is None:
+            self._reflection_index = self.reflections()
+        index = self._reflection_index
+        key = (os.path.abspath(index.path), user)
+        with _imported_logs_lock:
+            if key not in _imported_logs:
+                for source, text in self.legacy_logs(user):
+                    index.import_text(user, source, text)
+                _imported_logs.add(key)
+        return index
+
+    def create_user(self, user):
+        """Skapar användarens namnrymd om den saknas, load och sökningar skapar den inte"""
+        raise NotImplementedError
+
+    def recalculate_streaks(self, user):
+        """Räknar om användarens streak-räknare från historiken och returnerar snapshoten"""
+        raise NotImplementedError
+
+    def rollup(self, user, cutoff_day):
+        """Rullar ihop användarens incheckningar före cutoff_day (dagnummer) till månadsaggregat
+
+        Returnerar snapshoten, vars räknare fortfarande gäller alla incheckningar.
+        """
+        raise NotImplementedError
+
+    def rollups(self, user):
+        """Returnerar användarens månadsaggregat, se empty_rollup"""
+        raise NotImplementedError
+
+    def version(self, user):
+        """Returnerar en billig markör som ändras när användarens data skrivs, även från andra processer"""
+        raise NotImplementedError
+
+    def users(self):
+        """Returnerar alla användare som har data i lagringen"""
+        raise NotImplementedError
+
+    def legacy_file_for(self, user):
+        # Bara standardanvändaren ärver den gamla lindas_streak_data.json
+        return self.legacy_file if user == self.legacy_user else None
+
+
+class JournalStorage(Storage):
+    """Lagring i filer, en katalog med journal och snapshot per användare"""
+
+    def __init__(self, root, legacy_file=LEGACY_STREAK_FILE, legacy_log_file=LEGACY_LOG_FILE,
+                 legacy_user=DEFAULT_USER):
+        self.root = root
+        self.legacy_file = legacy_file
+        self.legacy_log_file = legacy_log_file
+        self.legacy_user = legacy_user
+
+    def journal(self, user):
+        """Returnerar journalen för användaren"""
+        directory = os.path.join(self.root, check_user(user))
+        return CheckinJournal(directory, legacy_file=self.legacy_file_for(user))
+
+    def load(self, user):
+        return self.journal(user).load()
+
+    def append_many(self, user, records):
+        return self.journal(user).append_many(records)
+
+    def create_user(self, user):
+        self.journal(user).create()
+
+    def iter_history(self, user, chunk_size=50_000, start=0):
+        return self.journal(user).iter_history(chunk_size, start)
+
+    def read_history(self, user):
+        return self.journal(user).read_history()
+
+    def recalculate_streaks(self, user):
+        return self.journal(user).recalculate()
+
+    def rollup(self, user, cutoff_day):
+        return self.journal(user).rollup(cutoff_day)
+
+    def rollups(self, user):
+        return self.journal(user).rollups()
+
+    def version(self, user):
+        # Varje skrivning ändrar storlek eller tid på journalen eller snapshoten,
+        # en komprimering byter dessutom journalfil, så det räcker att titta på katalogen
+        try:
+            with os.scandir(os.path.join(self.root, check_user(user))) as entries:
+                return tuple(sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                                    for entry in entries
+                                    if entry.name == SNAPSHOT_FILE or entry.name.startswith("journal")))
+        except FileNotFoundError:
+            return ()
+
+    def reflections(self):
+        return ReflectionIndex(os.path.join(self.root, REFLECTIONS_FILE))
+
+    def users(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if USER_PATTERN.fullmatch(name) and os.path.isdir(os.path.join(self.root, name)))
+
+
+class SqliteStorage(Storage):
+    """Lagring i en inbäddad SQLite-databas i WAL-läge, indexerad på (user, date)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS checkins (
+            id INTEGER PRIMARY KEY,
+            user TEXT NOT NULL,
+            date TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            feeling TEXT NOT NULL,
+            phase TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_checkins_user_date ON checkins (user, date);
+        CREATE TABLE IF NOT EXISTS snapshots (
+            user TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS rollups (
+            user TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path, legacy_file=LEGACY_STREAK_FILE, legacy_log_file=LEGACY_LOG_FILE,
+                 legacy_user=DEFAULT_USER):
+        self.path = path
+        self.legacy_file = legacy_file
+        self.legacy_log_file = legacy_log_file
+        self.legacy_user = legacy_user
+
+    def connection(self):
+        """Returnerar processens anslutning och låset som skyddar den"""
+        return sqlite_connection(self.path, self.SCHEMA)
+
+    def load(self, user):
+        conn, lock = self.connection()
+        user = check_user(user)
+        with lock:
+            row = conn.execute("SELECT data FROM snapshots WHERE user = ?", (user,)).fetchone()
+            if row is not None:
+                return json.loads(row[0])
+            # En läsning skapar ingen användare, det gör första skrivningen
+            legacy_file = self.legacy_file_for(user)
+            if not (legacy_file and os.path.exists(legacy_file)):
+                return empty_snapshot()
+            return sqlite_transaction(conn, lambda: self._load(conn, user))
+
+    def create_user(self, user):
+        conn, lock = self.connection()
+        user = check_user(user)
+        with lock:
+            if conn.execute("SELECT 1 FROM snapshots WHERE user = ?", (user,)).fetchone() is None:
+                sqlite_transaction(conn, lambda: self._load(conn, user))
+
+    def append_many(self, user, records):
+        conn, lock = self.connection()
+        user = check_user(user)
+
+        def write():
+            snapshot = self._load(conn, user)
+            for record in records:
+                apply_checkin(snapshot, record)
+            self._insert_checkins(conn, user, records)
+            # En incheckning bakåt i tiden räknas in genom att streaken räknas om
+            if snapshot.get("streaks_stale"):
+                recalculate_streaks(snapshot, self._days(conn, user), rollup_days(self._rollup(conn, user)))
+            self._save_snapshot(conn, user, snapshot)
+            return snapshot
+
+        with lock:
+            return sqlite_transaction(conn, write)
+
+    def recalculate_streaks(self, user):
+        conn, lock = self.connection()
+        user = check_user(user)
+
+        def write():
+            snapshot = recalculate_streaks(self._load(conn, user), self._days(conn, user),
+                                           rollup_days(self._rollup(conn, user)))
+            self._save_snapshot(conn, user, snapshot)
+            return snapshot
+
+        with lock:
+            return sqlite_transaction(conn, write)
+
+    def rollup(self, user, cutoff_day):
+        from streaks import day_date
+        conn, lock = self.connection()
+        user = check_user(user)
+        cutoff = day_date(cutoff_day).isoformat()
+
+        def write():
+            snapshot = self._load(conn, user)
+            if not has_checkins_before(snapshot, cutoff_day):
+                return snapshot
+            rows = conn.execute("SELECT date, feeling, phase FROM checkins WHERE user = ? AND date < ?",
+                                (user, cutoff)).fetchall()
+            if not rows:
+                return snapshot
+            records = [{"date": date, "feeling": feeling, "phase": phase} for date, feeling, phase in rows]
+            rollup = rollup_checkins(history_table(records), self._rollup(conn, user))
+            conn.execute("DELETE FROM checkins WHERE user = ? AND date < ?", (user, cutoff))
+            conn.execute(
+                "INSERT INTO rollups (user, data) VALUES (?, ?) "
+                "ON CONFLICT (user) DO UPDATE SET data = excluded.data",
+                (user, json.dumps(rollup, ensure_ascii=False))
+            )
+            snapshot["rollup_generation"] = snapshot.get("rollup_generation", 0) + 1
+            snapshot["rolled_up"] = snapshot.get("rolled_up", 0) + len(rows)
+            first = conn.execute("SELECT MIN(date) FROM checkins WHERE user = ?", (user,)).fetchone()[0]
+            snapshot["first_check_in"] = first or ""
+            self._save_snapshot(conn, user, snapshot)
+            return snapshot
+
+        with lock:
+            return sqlite_transaction(conn, write)
+
+    def rollups(self, user):
+        conn, lock = self.connection()
+        with lock:
+            return self._rollup(conn, check_user(user))
+
+    def version(self, user):
+        # data_version ändras när en annan anslutning skriver, total_changes när vi själva gör det.
+        # Markören gäller hela databasen, en skrivning för en användare gör alla andras inaktuella
+        conn, lock = self.connection()
+        with lock:
+            return conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes
+
+    def read_history(self, user):
+        conn, lock = self.connection()
+        with lock:
+            rows = conn.execute(
+                "SELECT date, feeling, phase FROM checkins WHERE user = ? ORDER BY date, id",
+                (check_user(user),)
+            ).fetchall()
+        records = [{"date": date, "feeling": feeling, "phase": phase} for date, feeling, phase in rows]
+        return history_frame(history_table(records))
+
+    def iter_history(self, user, chunk_size=50_000, start=0):
+        conn, lock = self.connection()
+        # Läses i bitar via rowid så att låset inte hålls under hela exporten
+        last_id = 0
+        if start:
+            with lock:
+                row = conn.execute("SELECT id FROM checkins WHERE user = ? ORDER BY id LIMIT 1 OFFSET ?",
+                                   (check_user(user), start - 1)).fetchone()
+            if row is None:
+                return
+            last_id = row[0]
+        while True:
+            with lock:
+                rows = conn.execute(
+                    "SELECT id, date, feeling, phase FROM checkins WHERE user = ? AND id > ? ORDER BY id LIMIT ?",
+                    (check_user(user), last_id, chunk_size)
+                ).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            records = [{"date": date, "feeling": feeling, "phase": phase} for _, date, feeling, phase in rows]
+            yield from history_table(records).to_batches()
+
+    def reflections(self):
+        return ReflectionIndex(self.path)
+
+    def users(self):
+        conn, lock = self.connection()
+        with lock:
+            return [user for (user,) in conn.execute("SELECT user FROM snapshots ORDER BY user")]
+
+    def _load(self, conn, user):
+        row = conn.execute("SELECT data FROM snapshots WHERE user = ?", (user,)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+
+        # Första gången flyttas den gamla JSON-filen in i databasen
+        snapshot, records = read_legacy(self.legacy_file_for(user))
+        self._insert_checkins(conn, user, records)
+        self._save_snapshot(conn, user, snapshot)
+        return snapshot
+
+    def _rollup(self, conn, user):
+        row = conn.execute("SELECT data FROM rollups WHERE user = ?", (user,)).fetchone()
+        return json.loads(row[0]) if row is not None else empty_rollup()
+
+    def _days(self, conn, user):
+        import numpy as np
+        # julianday 2440587.5 är 1970-01-01, så uttrycket ger samma dagnummer som historikfilen
+        rows = conn.execute(
+            "SELECT CAST(julianday(date) - 2440587.5 AS INTEGER) FROM checkins WHERE user = ?", (user,)
+        ).fetchall()
+        return np.fromiter((day for (day,) in rows), dtype=np.int32, count=len(rows))
+
+    def _insert_checkins(self, conn, user, records):
+        conn.executemany(
+            "INSERT INTO checkins (user, date, ts, feeling, phase) VALUES (?, ?, ?, ?, ?)",
+            [(user, r["date"], r["ts"], r["feeling"], r["phase"]) for r in records]
+        )
+
+    def _save_snapshot(self, conn, user, snapshot):
+        conn.execute(
+            "INSERT INTO snapshots (user, data) VALUES (?, ?) "
+            "ON CONFLICT (user) DO UPDATE SET data = excluded.data",
+            (user, json.dumps(snapshot, ensure_ascii=False))
+        )
+
+
+class SnapshotCache:
+    """Processgemensam läscache för snapshots, så att sessionerna delar en kopia per användare
+
+    Snapshoten som returneras delas mellan sessioner och får inte ändras. Före varje
+    träff jämförs lagringens versionsmarkör, så skrivningar från andra processer syns direkt.
+    """
+
+    def __init__(self, storage, max_users=1024):
+        self.storage = storage
+        self.max_users = max_users
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, user):
+        """Returnerar användarens snapshot, läst från lagringen bara om den ändrats"""
+        # Markören läses före snapshoten, så en samtidig skrivning ger i värsta fall en onödig omläsning
+        version = self.storage.version(user)
+        with self._lock:
+            entry = self._entries.get(user)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(user)
+                return entry[1]
+
+        snapshot = self.storage.load(user)
+        with self._lock:
+            self._entries[user] = (version, snapshot)
+            self._entries.move_to_end(user)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return snapshot
+
+    def append(self, user, record):
+        """Sparar en incheckning och returnerar den uppdaterade snapshoten"""
+        snapshot = self.storage.append(user, record)
+        self.invalidate(user)
+        return snapshot
+
+    def invalidate(self, user=None):
+        """Glömmer en användares snapshot, eller alla om ingen användare anges"""
+        with self._lock:
+            if user is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def open_storage(kind, root):
+    """Skapar lagringen som valts i konfigurationen ("journal" eller "sqlite")"""
+    if kind == "journal":
+        return JournalStorage(root)
+    if kind == "sqlite":
+        return SqliteStorage(os.path.join(root, SQLITE_FILE))
+    raise ValueError(f"Okänd lagringstyp: {kind!r}")
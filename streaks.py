@@ -0,0 +1,68 @@
+import datetime
+
+import numpy as np
+
+# Dagar räknas som heltal sedan 1970-01-01, samma som kolumnen "day" i historikfilen
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def day_number(date):
+    """Gör om ett datum (date eller ÅÅÅÅ-MM-DD) till ett dagnummer"""
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date)
+    return (date - EPOCH).days
+
+
+def day_date(day):
+    """Gör om ett dagnummer till ett datum"""
+    return EPOCH + datetime.timedelta(days=int(day))
+
+
+def calendar(days):
+    """Returnerar de unika incheckningsdagarna sorterade, oavsett i vilken ordning de kom in"""
+    return np.unique(np.asarray(days, dtype=np.int32))
+
+
+def runs(days):
+    """Returnerar (startdag, längd) för varje sammanhängande följd av incheckningsdagar"""
+    unique = calendar(days)
+    if unique.size == 0:
+        return unique, unique
+    # En ny följd börjar där avståndet till föregående dag är mer än en dag
+    breaks = np.flatnonzero(np.diff(unique) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [unique.size]))
+    return unique[starts], (ends - starts).astype(np.int32)
+
+
+def compute_streaks(days):
+    """Räknar fram streak-räknarna ur incheckningsdagarna
+
+    current_streak är längden på följden som slutar med den senaste incheckningen,
+    precis som när räknarna uppdateras en incheckning i taget.
+    """
+    starts, lengths = runs(days)
+    if lengths.size == 0:
+        return {"current_streak": 0, "highest_streak": 0, "last_check_in": ""}
+    return {
+        "current_streak": int(lengths[-1]),
+        "highest_streak": int(lengths.max()),
+        "last_check_in": day_date(starts[-1] + lengths[-1] - 1).isoformat()
+    }
+
+
+def gaps(days):
+    """Returnerar (första missade dag, antal dagar) för varje uppehåll mellan incheckningar"""
+    starts, lengths = runs(days)
+    if lengths.size < 2:
+        empty = np.empty(0, dtype=np.int32)
+        return empty, empty
+    run_ends = starts[:-1] + lengths[:-1]
+    return run_ends, (starts[1:] - run_ends).astype(np.int32)
+
+
+def checkins_in_last(days, n, today=None):
+    """Räknar incheckningarna de senaste n dagarna, idag inräknat"""
+    today = day_number(today or datetime.date.today())
+    ordered = np.sort(np.asarray(days, dtype=np.int32))
+    return int(np.searchsorted(ordered, today, side="right") - np.searchsorted(ordered, today - n + 1))
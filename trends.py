@@ -0,0 +1,90 @@
+import numpy as np
+
+# Dagar räknas som heltal sedan 1970-01-01, samma som kolumnen "day" i historikfilen.
+# 1970-01-01 var en torsdag, så veckan (måndag-söndag) börjar 3 dagar tidigare
+WEEK_OFFSET = 3
+
+# Längsta tidsspann (dagar) som visas per dag respektive per vecka, längre visas per månad
+DAY_SPAN = 92
+WEEK_SPAN = 2 * 366
+
+GRANULARITY_LABELS = {"D": "dag", "W": "vecka", "M": "månad"}
+
+
+def choose_granularity(first_day, last_day):
+    """Väljer dag, vecka eller månad så att diagrammet får högst ett hundratal punkter per känsla"""
+    span = int(last_day) - int(first_day) + 1
+    if span <= DAY_SPAN:
+        return "D"
+    if span <= WEEK_SPAN:
+        return "W"
+    return "M"
+
+
+def bucket_starts(days, granularity):
+    """Returnerar första dagen i dagens, veckans eller månadens hink för varje dagnummer"""
+    days = np.asarray(days, dtype=np.int64)
+    if granularity == "D":
+        return days.astype("datetime64[D]")
+    if granularity == "W":
+        return (days - (days + WEEK_OFFSET) % 7).astype("datetime64[D]")
+    if granularity == "M":
+        return days.astype("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]")
+    raise ValueError(f"Okänd tidsindelning: {granularity!r}")
+
+
+def dictionary_codes(column, codes):
+    """Översätter en ordlistekodad Arrow-kolumn till index i en gemensam lista
+
+    codes är en dict från namn till index som fylls på med namn som inte setts förut,
+    så indexen är desamma mellan batchar som har olika ordlistor.
+    """
+    mapping = np.array([codes.setdefault(name, len(codes)) for name in column.dictionary.to_pylist()],
+                       dtype=np.int64)
+    return mapping[column.indices.to_numpy(zero_copy_only=False).astype(np.int64)]
+
+
+def feeling_columns(batches, rollup=None):
+    """Läser dagnummer och känslor ur historikens Arrow-batchar
+
+    Känslorna kodas som index i en gemensam lista, så resten av räkningen blir
+    heltalsoperationer oavsett hur lång historiken är. Hoprullade månader från
+    rollup kommer först, som en rad per månad och känsla med antalet som vikt.
+    Returnerar (dagar, känslor, känslornas namn, vikter).
+    """
+    codes = {}
+    day_parts, feeling_parts, weight_parts = [], [], []
+    if rollup and rollup["months"]:
+        months = np.array([[month, count] for month, _, _, count in rollup["months"]], dtype=np.int64)
+        day_parts.append(months[:, 0])
+        feeling_parts.append(np.array([codes.setdefault(feeling, len(codes)) for _, feeling, _, _ in rollup["months"]],
+                                      dtype=np.int64))
+        weight_parts.append(months[:, 1])
+    for batch in batches:
+        day_parts.append(batch.column("day").to_numpy(zero_copy_only=False))
+        feeling_parts.append(dictionary_codes(batch.column("feeling"), codes))
+        weight_parts.append(np.ones(batch.num_rows, dtype=np.int64))
+    feelings = sorted(codes, key=codes.get)
+    if not day_parts:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64), feelings, np.empty(0, dtype=np.int64)
+    return np.concatenate(day_parts), np.concatenate(feeling_parts), feelings, np.concatenate(weight_parts)
+
+
+def feeling_buckets(days, feeling_codes, feelings, weights=None, granularity=None):
+    """Räknar känslorna per tidshink
+
+    Returnerar (tidsindelning, hinkarnas startdatum, känslor, antal) där antal har
+    en rad per hink och en kolumn per känsla. Storleken beror bara på antalet hinkar.
+    Hoprullade månader (se feeling_columns) blir bara rätt med tidsindelningen "M".
+    """
+    days = np.asarray(days)
+    if days.size == 0:
+        empty = np.zeros((0, len(feelings)), dtype=np.int64)
+        return granularity or "D", np.empty(0, dtype="datetime64[D]"), list(feelings), empty
+
+    granularity = granularity or choose_granularity(days.min(), days.max())
+    periods, bucket = np.unique(bucket_starts(days, granularity), return_inverse=True)
+    width = len(feelings)
+    counts = np.bincount(bucket.ravel() * width + np.asarray(feeling_codes), weights=weights,
+                         minlength=periods.size * width).astype(np.int64)
+    return granularity, periods, list(feelings), counts.reshape(periods.size, width)
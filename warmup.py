@@ -0,0 +1,42 @@
+import logging
+import os
+import threading
+
+import metrics
+from content import available_packs, load_pack
+
+# Uppvärmningen stängs av med LIVSPULS_WARMUP=0, t.ex. i mätningar av kallstart
+ENABLED = os.environ.get("LIVSPULS_WARMUP", "1") not in ("", "0")
+MAX_USERS = int(os.environ.get("LIVSPULS_WARMUP_USERS", "100"))
+
+logger = logging.getLogger("livspuls.warmup")
+
+_lock = threading.Lock()
+_thread = None
+
+
+def start(snapshot_cache):
+    """Värmer upp processens cacher i en bakgrundstråd, en gång per process
+
+    Första sidvisningen behöver då inte vänta på innehållspaketen eller användarnas
+    snapshots. pandas och Plotly läses in först när någon öppnar trendanalysen.
+    """
+    global _thread
+    with _lock:
+        if _thread is not None or not ENABLED:
+            return _thread
+        _thread = threading.Thread(target=_warm, args=(snapshot_cache,), name="livspuls-warmup", daemon=True)
+    _thread.start()
+    return _thread
+
+
+def _warm(snapshot_cache):
+    try:
+        with metrics.stage("warmup"):
+            for name in available_packs():
+                load_pack(name)
+            for user in snapshot_cache.storage.users()[:MAX_USERS]:
+                snapshot_cache.load(user)
+    except Exception:
+        # Uppvärmningen är bara en optimering, appen läser in allt själv om den misslyckas
+        logger.exception("Uppvärmningen av cacherna misslyckades")
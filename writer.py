@@ -0,0 +1,209 @@
+import atexit
+import collections
+import copy
+import logging
+import os
+import queue
+import threading
+import time
+
+import metrics
+from storage import apply_checkin
+
+# "batch" skriver i bakgrunden med gruppcommits, "sync" skriver direkt i sessionens tråd.
+# Med "batch" kan det som ligger i kön, högst FLUSH_INTERVAL sekunder, gå förlorat vid en krasch
+DURABILITY = os.environ.get("LIVSPULS_DURABILITY", "batch")
+FLUSH_INTERVAL = float(os.environ.get("LIVSPULS_FLUSH_INTERVAL", "0.5"))
+BATCH_SIZE = int(os.environ.get("LIVSPULS_WRITE_BATCH", "100"))
+QUEUE_SIZE = int(os.environ.get("LIVSPULS_WRITE_QUEUE", "10000"))
+# Försök per grupp innan den läggs åt sidan, och hur ofta (sekunder) det som lagts åt sidan försöks igen
+WRITE_RETRIES = int(os.environ.get("LIVSPULS_WRITE_RETRIES", "3"))
+RETRY_INTERVAL = float(os.environ.get("LIVSPULS_RETRY_INTERVAL", "5"))
+
+logger = logging.getLogger("livspuls.writer")
+
+
+class BackgroundWriter:
+    """Skriver incheckningar och reflektioner i en bakgrundstråd
+
+    Skrivningarna läggs i en begränsad kö och sparas i grupper, en transaktion och
+    en fsync per användare och grupp, i samma ordning som de kom. Tills en incheckning
+    är sparad returnerar load en snapshot där den redan är inräknad.
+
+    Om lagringen inte går att skriva till (t.ex. full disk) läggs gruppen åt sidan efter
+    några försök och försöks igen i bakgrunden. Under tiden returnerar flush False för
+    användaren vars poster väntar och load visar det som faktiskt är sparat.
+    """
+
+    def __init__(self, cache, durability=DURABILITY, interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE,
+                 queue_size=QUEUE_SIZE, retries=WRITE_RETRIES, retry_interval=RETRY_INTERVAL):
+        if durability not in ("batch", "sync"):
+            raise ValueError(f"Okänd hållbarhetsnivå: {durability!r}")
+        self.cache = cache
+        self.storage = cache.storage
+        self.durability = durability
+        self.interval = interval
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_interval = retry_interval
+        # Poster som inte gick att spara, de skrivs före nya poster nästa gång
+        self._failed = []
+        self.last_error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        # Väcks när en grupp är behandlad, så flush kan vänta på en enskild användare
+        self._done = threading.Condition(self._lock)
+        # Användare -> [antal osparade incheckningar, snapshot med dem inräknade]
+        self._pending = {}
+        # Användare -> löpnummer för den senast köade posten och den senast behandlade
+        self._queued = collections.Counter()
+        self._handled = collections.Counter()
+        self._thread = None
+        if durability == "batch":
+            self._thread = threading.Thread(target=self._run, name="livspuls-writer", daemon=True)
+            self._thread.start()
+            # Det som ligger kvar i kön sparas innan processen avslutas, men högst i 30 sekunder
+            atexit.register(self.flush, timeout=30)
+
+    def load(self, user):
+        """Returnerar användarens snapshot, med incheckningar som ännu inte sparats inräknade"""
+        with self._lock:
+            pending = self._pending.get(user)
+            if pending is not None:
+                return pending[1]
+        return self.cache.load(user)
+
+    def append(self, user, record):
+        """Lägger en incheckning i kön och returnerar snapshoten som den kommer att bli"""
+        if self._thread is None:
+            return self.cache.append(user, record)
+
+        # Låset hålls medan snapshoten räknas fram, så att två sessioner inte tappar varandras incheckningar
+        with self._lock:
+            count, base = self._pending.get(user) or (0, None)
+            if base is None:
+                base = self.cache.load(user)
+            snapshot = apply_checkin(copy.deepcopy(base), record)
+            self._pending[user] = [count + 1, snapshot]
+            self._queued[user] += 1
+            number = self._queued[user]
+        self._queue.put(("checkin", user, record, number))
+        metrics.count("writer.queued")
+        return snapshot
+
+    def save_reflection(self, user, entry):
+        """Lägger en reflektion i kön, eller sparar den direkt med durability "sync\""""
+        if self._thread is None:
+            self.storage.save_reflection(user, entry)
+            return
+        with self._lock:
+            self._queued[user] += 1
+            number = self._queued[user]
+        self._queue.put(("reflection", user, entry, number))
+        metrics.count("writer.queued")
+
+    def flush(self, user=None, timeout=None):
+        """Väntar tills det användaren lagt i kön är behandlat, eller hela kön utan user
+
+        Väntar inte på andra användares skrivningar, så en jämn ström från andra
+        sessioner fördröjer inte flush. Returnerar False om tiden tog slut eller om
+        något av användarens poster (alla poster utan user) inte gick att spara.
+        """
+        if self._thread is None:
+            return True
+        if user is None:
+            return self._flush_all(timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._done:
+            target = self._queued[user]
+            while self._handled[user] < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._done.wait(remaining)
+            return not any(item[1] == user for item in self._failed)
+
+    def _flush_all(self, timeout):
+        if timeout is None:
+            self._queue.join()
+        else:
+            deadline = time.monotonic() + timeout
+            while self._queue.unfinished_tasks:
+                if time.monotonic() > deadline:
+                    return False
+                time.sleep(0.01)
+        with self._lock:
+            return not self._failed
+
+    def _run(self):
+        while True:
+            try:
+                # Med poster som väntar på ett nytt försök vaknar tråden även utan nya skrivningar
+                batch = [self._queue.get(timeout=self.retry_interval if self._failed else None)]
+            except queue.Empty:
+                self._commit([])
+                continue
+            # Samla det som hinner komma in under intervallet, eller tills gruppen är full
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _commit(self, batch):
+        with self._lock:
+            batch, self._failed = self._failed + batch, []
+        checkins = collections.defaultdict(list)
+        reflections = collections.defaultdict(list)
+        for kind, user, item, _ in batch:
+            (checkins if kind == "checkin" else reflections)[user].append(item)
+
+        # Incheckningar och reflektioner ligger i olika tabeller, ordningen inom varje användare behålls
+        with metrics.stage("writer.commit"):
+            for user, records in checkins.items():
+                saved = self._retry(self.storage.append_many, user, records)
+                with self._lock:
+                    if not saved:
+                        self._failed += [item for item in batch if item[0] == "checkin" and item[1] == user]
+                    pending = self._pending.get(user)
+                    # Sidhuvudet ska inte visa incheckningar som inte gick att spara
+                    if pending is not None and not saved:
+                        del self._pending[user]
+                    elif pending is not None:
+                        pending[0] -= len(records)
+                        if pending[0] <= 0:
+                            del self._pending[user]
+            for user, entries in reflections.items():
+                if not self._retry(self.storage.save_reflections, user, entries):
+                    with self._lock:
+                        self._failed += [item for item in batch if item[0] == "reflection" and item[1] == user]
+        with self._done:
+            # Även poster som lagts åt sidan räknas som behandlade, flush ser dem i _failed
+            for _, user, _, number in batch:
+                self._handled[user] = max(self._handled[user], number)
+            self._done.notify_all()
+        metrics.count("writer.commits")
+
+    def _retry(self, write, user, items):
+        # Ett tillfälligt fel skrivs om några gånger, sedan läggs gruppen åt sidan i stället för att
+        # blockera kön, så att flush inte hänger och felet kan visas
+        for attempt in range(self.retries):
+            try:
+                write(user, items)
+                self.last_error = None
+                return True
+            except Exception as e:
+                logger.exception("Kunde inte spara %d poster för %s (försök %d av %d)",
+                                 len(items), user, attempt + 1, self.retries)
+                self.last_error = e
+                if attempt + 1 < self.retries:
+                    time.sleep(min(self.interval * 2 ** attempt, self.retry_interval))
+        metrics.count("writer.failed", len(items))
+        return False